@@ -0,0 +1,119 @@
+"""
+Runs a full export.py against the mock Canvas server and reports wall time, requests, bytes and peak memory.
+
+    python benchmarks/bench_export.py [--courses N] [--assignments N] ... [--repeat N] [--html] [-- export args]
+
+Everything after `--` is passed to export.py. Pages are not saved unless --html is given, since that needs SingleFile
+and Chrome; the HTML endpoints are still there for it.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from mock_canvas import MockCanvasServer, add_data_arguments, data_from_args
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def directory_size(path: Path) -> int:
+    # Hardlinked blobs are only counted once.
+    seen = set()
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            stat = os.stat(os.path.join(root, name))
+            if (stat.st_dev, stat.st_ino) not in seen:
+                seen.add((stat.st_dev, stat.st_ino))
+                total += stat.st_size
+    return total
+
+
+def run_export(server: MockCanvasServer, work_dir: Path, export_args) -> dict:
+    cookies = work_dir / 'cookies.txt'
+    cookies.write_text('# Netscape HTTP Cookie File\n')
+    credentials = work_dir / 'credentials.yaml'
+    credentials.write_text(json.dumps({
+        'API_URL': server.data.base_url, 'API_KEY': 'benchmark', 'USER_ID': 1, 'COOKIES_PATH': str(cookies),
+    }))
+    output = work_dir / 'output'
+
+    server.reset_stats()
+    args = [sys.executable, str(REPO_ROOT / 'export.py'), '--credentials', str(credentials), '--output', str(output), *export_args]
+    start = time.perf_counter()
+    with open(work_dir / 'export.log', 'w') as log:
+        process = subprocess.Popen(args, cwd=REPO_ROOT, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 gives the resource usage of this child alone.
+        _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    returncode = os.waitstatus_to_exitcode(status)
+    # Already reaped, so Popen must not wait for it again.
+    process.returncode = returncode
+
+    report_path = output / 'run_report.json'
+    report = json.loads(report_path.read_text()) if report_path.is_file() else {}
+    return {
+        'returncode': returncode,
+        'wall_time': round(elapsed, 3),
+        'requests': server.request_count,
+        'bytes_served': server.bytes_sent,
+        'output_bytes': directory_size(output) if output.is_dir() else 0,
+        # ru_maxrss is in KiB on Linux.
+        'peak_rss_mib': round(usage.ru_maxrss / 1024, 1),
+        'endpoints': dict(sorted(server.endpoints.items(), key=lambda e: -e[1])),
+        'phases': report.get('phases', {}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark a full export against a mock Canvas server.')
+    add_data_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=1, help='Number of fresh exports to run.')
+    parser.add_argument('--incremental', action='store_true', help='Run every export into the same output directory, so runs after the first measure an incremental export.')
+    parser.add_argument('--html', action='store_true', help='Also save HTML pages with SingleFile.')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    parser.add_argument('--keep', action='store_true', help="Don't delete the output and export logs.")
+    args, export_args = parser.parse_known_args()
+    export_args = [a for a in export_args if a != '--']
+    if not args.html:
+        export_args.append('--no-html')
+
+    server = MockCanvasServer(data_from_args(args)).start()
+    results = []
+    base_dir = Path(tempfile.mkdtemp(prefix='canvas-export-bench-'))
+    try:
+        for i in range(args.repeat):
+            work_dir = base_dir if args.incremental else base_dir / str(i)
+            work_dir.mkdir(parents=True, exist_ok=True)
+            results.append(run_export(server, work_dir, export_args))
+            if results[-1]['returncode'] != 0:
+                print(f'export.py exited with {results[-1]["returncode"]}, see {work_dir / "export.log"}', file=sys.stderr)
+                args.keep = True
+                break
+    finally:
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(base_dir, ignore_errors=True)
+        else:
+            print('Output kept in', base_dir, file=sys.stderr)
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+
+    for i, r in enumerate(results):
+        print(f'run {i + 1}: {r["wall_time"]:8.2f} s  {r["requests"]:6d} requests  {r["bytes_served"] / 2 ** 20:8.1f} MiB served  '
+              f'{r["output_bytes"] / 2 ** 20:8.1f} MiB written  peak RSS {r["peak_rss_mib"]:7.1f} MiB')
+    if results:
+        print('\nRequests by endpoint (last run):')
+        for endpoint, count in list(results[-1]['endpoints'].items())[:15]:
+            print(f'{count:8d}  {endpoint}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Measures peak memory of exporting synthetic courses' metadata the old way (every view held until the end, then
+serialized at once) against streaming each stage and dropping it, with and without spilling large bodies to disk.
+Streaming includes building the per-course and combined JSON files from the streams, so its peak shouldn't grow with
+--courses.
+
+    python benchmarks/bench_memory.py [--courses N] [--assignments N] [--discussions N] [--posts N]
+"""
+import argparse
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_serialize import make_course  # noqa: E402
+from module.const import global_consts  # noqa: E402
+from module.serialize import jsonify_anything  # noqa: E402
+from module.stream import COURSE_LISTS, MetadataStream, compact_stream  # noqa: E402
+
+
+def held(args, out_dir: Path):
+    courses = [make_course(args.assignments, args.discussions, args.posts, args.body_repeat, course_id) for course_id in range(args.courses)]
+    (out_dir / 'held.json').write_text(jsonify_anything(courses))
+
+
+def streamed(args, out_dir: Path):
+    all_path = out_dir / 'streamed.ndjson'
+    all_stream = MetadataStream(all_path)
+    for course_id in range(args.courses):
+        course_path = out_dir / f'streamed-{course_id}.ndjson'
+        stream = MetadataStream(course_path, mirror=all_stream)
+        stream.write_course(make_course(0, 0, 0, course_id=course_id))
+        # Build and write one stage at a time, the way export_course does now.
+        for stage in COURSE_LISTS.values():
+            course = make_course(args.assignments if stage in ('assignments', 'pages') else 0, args.discussions if stage == 'discussions' else 0, args.posts, args.body_repeat, course_id)
+            stream.write_items(stage, course_id, getattr(course, stage))
+            del course
+        stream.close()
+        compact_stream(course_path, out_dir / f'streamed-{course_id}.json', single_course=True)
+    all_stream.close()
+    compact_stream(all_path, out_dir / 'streamed.json')
+
+
+def measure(func, args, out_dir):
+    tracemalloc.start()
+    func(args, out_dir)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark metadata memory use.')
+    parser.add_argument('--courses', type=int, default=1, help='Number of synthetic courses.')
+    parser.add_argument('--assignments', type=int, default=1000, help='Number of assignments in the synthetic course.')
+    parser.add_argument('--discussions', type=int, default=100, help='Number of discussions in the synthetic course.')
+    parser.add_argument('--posts', type=int, default=50, help='Number of posts in each discussion.')
+    parser.add_argument('--body-repeat', type=int, default=700, help='Times the filler sentence is repeated in each body. The default makes ~20 KB bodies.')
+    args = parser.parse_args()
+
+    cases = [
+        ('held, no spilling', held, 0),
+        ('held, spilling', held, global_consts.SPILL_THRESHOLD),
+        ('streamed, no spilling', streamed, 0),
+        ('streamed, spilling', streamed, global_consts.SPILL_THRESHOLD),
+    ]
+    baseline = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, func, threshold in cases:
+            global_consts.SPILL_THRESHOLD = threshold
+            peak = measure(func, args, Path(tmp))
+            baseline = baseline or peak
+            print(f'{name:>22}: peak {peak / 2 ** 20:8.1f} MiB  {baseline / peak:5.1f}x')
+
+
+if __name__ == '__main__':
+    main()
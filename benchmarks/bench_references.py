@@ -0,0 +1,86 @@
+"""
+Compares the single-pass reference extractor against the regex pair it replaced on large synthetic HTML bodies.
+Links to other sites with a Canvas-like path must not be picked up.
+
+    python benchmarks/bench_references.py [--links N] [--repeat N]
+"""
+import argparse
+import random
+import re
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from module.api.references import extract_references  # noqa: E402
+
+CANVAS_HOST = 'canvas.example.edu'
+
+# The patterns used before the extractor, kept here as the baseline.
+HTML_ITEM_ATTACHED_FILE_RE = re.compile(r'<a .*? data-api-endpoint=\"(.*?)\" .*?>')
+CANVAS_API_FILE_ID_RE = re.compile(r'.*?/api/v1/courses/.*?/files/(.*?)$')
+
+
+def legacy_file_ids(html):
+    ids = []
+    for match in re.findall(HTML_ITEM_ATTACHED_FILE_RE, html):
+        file_id = re.match(CANVAS_API_FILE_ID_RE, match)
+        if file_id:
+            ids.append(file_id.group(1))
+    return ids
+
+
+def make_body(links: int, single_line: bool, file_links: bool = True, seed: int = 0) -> str:
+    rnd = random.Random(seed)
+    filler = 'Lorem ipsum dolor sit amet, <strong>consectetur</strong> adipiscing elit. '
+    parts = ['<div class="user_content">']
+    for i in range(links):
+        file_id = 1000 + i
+        parts.append(f'<p>{filler}<a href="https://example.com/reading/{i}">reading</a> {filler}</p>')
+        if i % 10 == 0:
+            parts.append(f'<a href="https://other.example.org/files/{i}">another site</a>')
+        if not file_links:
+            continue
+        parts.append(
+            f'<a class="instructure_file_link" title="file{i}.pdf" href="https://{CANVAS_HOST}/courses/42/files/{file_id}?wrap=1" '
+            f'data-api-endpoint="https://{CANVAS_HOST}/api/v1/courses/42/files/{file_id}" data-api-returntype="File">file{i}.pdf</a>'
+        )
+        if rnd.random() < 0.3:
+            parts.append(f'<img src="/courses/42/files/{file_id + 50000}/preview" alt="">')
+        if rnd.random() < 0.1:
+            parts.append(f'<a href="/media_objects/m-{i}" data-media-id="m-{i}">video</a>')
+    parts.append('</div>')
+    return ('' if single_line else '\n').join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark HTML reference extraction.')
+    parser.add_argument('--links', type=int, default=500, help='Number of links in each synthetic body.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs per case.')
+    args = parser.parse_args()
+
+    # The rich content editor saves bodies on a single line, which is where the old patterns fall over: every
+    # <a> without a data-api-endpoint scans to the end of the line.
+    cases = [
+        ('file links, multi line', make_body(args.links, single_line=False)),
+        ('file links, single line', make_body(args.links, single_line=True)),
+        ('plain links, single line', make_body(args.links, single_line=True, file_links=False)),
+    ]
+    for name, body in cases:
+        legacy = legacy_file_ids(body)
+        references = extract_references(body, CANVAS_HOST)
+        new = [ref.id for ref in references if ref.kind == 'file']
+        # Every file the old patterns found must still be found, and nothing from another site.
+        missing = set(legacy) - set(new)
+        assert not missing, f'extractor missed {len(missing)} file ids'
+        assert all(int(file_id) >= 1000 for file_id in new), 'extractor picked up a file on another site'
+
+        legacy_time = min(timeit.repeat(lambda: legacy_file_ids(body), number=1, repeat=args.repeat))
+        new_time = min(timeit.repeat(lambda: extract_references(body, CANVAS_HOST), number=1, repeat=args.repeat))
+        print(f'{name:>24}: {len(body) / 1024:8.1f} KiB  legacy {legacy_time * 1000:10.2f} ms ({len(legacy)} files)  '
+              f'extractor {new_time * 1000:8.2f} ms ({len(new)} files, {len(references)} references)  {legacy_time / new_time:8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
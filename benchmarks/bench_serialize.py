@@ -0,0 +1,130 @@
+"""
+Compares the serializer against the old varsify/jsonify_anything on a synthetic course.
+
+    python benchmarks/bench_serialize.py [--assignments N] [--repeat N]
+"""
+import argparse
+import json
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from canvasapi.assignment import Assignment  # noqa: E402
+from canvasapi.course import Course  # noqa: E402
+from canvasapi.discussion_topic import DiscussionTopic  # noqa: E402
+
+from module.items import CanvasCourse, CanvasDiscussion, CanvasPage, CanvasTopicEntry, CanvasTopicReply  # noqa: E402
+from module import serialize  # noqa: E402
+from module.serialize import jsonify_anything, orjson, dumps, to_data  # noqa: E402
+
+
+def legacy_vars(item):
+    # The view classes use __slots__ now; read them the way vars() used to see them.
+    if hasattr(item, '__dict__'):
+        return vars(item)
+    return {k.lstrip('_'): getattr(item, k.lstrip('_')) for k in type(item).__slots__ if hasattr(item, k)}
+
+
+def legacy_varsify(item):
+    # The implementation the serializer replaced, kept here as the baseline.
+    result = {}
+    try:
+        if isinstance(item, (str, int, float, bool)):
+            return item
+        elif isinstance(item, (list, set)):
+            l_result = []
+            for i, x in enumerate(item):
+                l_result.append(legacy_varsify(x))
+            return l_result
+        else:
+            for k, v in legacy_vars(item).items():
+                if isinstance(v, dict):
+                    result[k] = legacy_varsify(v)
+                elif isinstance(v, list):
+                    result[k] = []
+                    for i, x in enumerate(v):
+                        result[k].insert(i, legacy_varsify(x))
+                else:
+                    if not k.startswith('_'):
+                        result[k] = legacy_varsify(v)
+            return result
+    except:
+        return item
+
+
+def legacy_jsonify_anything(item):
+    return json.dumps(legacy_varsify(item), indent=4, sort_keys=True, default=str)
+
+
+def make_course(assignments: int, discussions: int, posts: int, body_repeat: int = 40, course_id: int = 1) -> CanvasCourse:
+    course = Course(None, {'id': course_id, 'name': 'Synthetic 101', 'course_code': 'SYN101', 'term': {'name': 'Fall 2023'}, 'created_at': '2023-08-01T00:00:00Z'})
+    view = CanvasCourse(course)
+    filler = 'Lorem ipsum dolor sit amet. ' * body_repeat
+
+    def body(name):
+        # A new string for every record, like bodies parsed from separate API responses.
+        return f'<p>{name} {filler}</p>'
+
+    for i in range(assignments):
+        view.assignments.append(Assignment(None, {
+            'id': i, 'course_id': 1, 'name': f'Assignment {i}', 'description': body(f'assignment {i}'), 'points_possible': 10,
+            'due_at': '2023-09-01T23:59:00Z', 'updated_at': '2023-08-15T12:00:00Z', 'html_url': f'https://canvas.example.edu/courses/1/assignments/{i}',
+            'submission_types': ['online_upload'], 'rubric': [{'id': f'r{j}', 'points': 5, 'description': 'Criterion'} for j in range(4)],
+            'submission': {'id': i, 'workflow_state': 'graded', 'score': 9, 'attachments': []},
+        }))
+    for i in range(discussions):
+        topic = DiscussionTopic(None, {'id': i, 'course_id': 1, 'title': f'Discussion {i}', 'message': body(f'discussion {i}'), 'created_at': '2023-08-02T00:00:00Z'})
+        discussion = CanvasDiscussion(topic)
+        discussion.id, discussion.title, discussion.body = i, topic.title, body(f'discussion {i}')
+        for j in range(posts):
+            entry = CanvasTopicEntry()
+            entry.id, entry.body = j, body(f'entry {i}.{j}')
+            reply = CanvasTopicReply()
+            reply.id, reply.body = j, body(f'reply {i}.{j}')
+            entry.topic_replies.append(reply)
+            discussion.topic_entries.append(entry)
+        view.discussions.append(discussion)
+    for i in range(assignments // 10):
+        page = CanvasPage()
+        page.id, page.title, page.body = i, f'Page {i}', body(f'page {i}')
+        view.pages.append(page)
+    return view
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark metadata serialization.')
+    parser.add_argument('--assignments', type=int, default=1000, help='Number of assignments in the synthetic course.')
+    parser.add_argument('--discussions', type=int, default=50, help='Number of discussions in the synthetic course.')
+    parser.add_argument('--posts', type=int, default=20, help='Number of posts in each discussion.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs per case.')
+    args = parser.parse_args()
+
+    course = make_course(args.assignments, args.discussions, args.posts)
+
+    def without_orjson(func):
+        def run():
+            serialize.orjson = None
+            try:
+                return func()
+            finally:
+                serialize.orjson = orjson
+        return run
+
+    cases = [
+        ('legacy jsonify_anything', lambda: legacy_jsonify_anything(course)),
+        (f'jsonify_anything ({"orjson" if orjson else "json"})', lambda: jsonify_anything(course)),
+        (f'compact ({"orjson" if orjson else "json"})', lambda: dumps(to_data(course))),
+    ]
+    if orjson:
+        cases.append(('jsonify_anything (json)', without_orjson(lambda: jsonify_anything(course))))
+    baseline = None
+    for name, func in cases:
+        elapsed = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        baseline = baseline or elapsed
+        print(f'{name:>24}: {elapsed * 1000:9.1f} ms  {len(func()) / 1024:9.1f} KiB  {baseline / elapsed:5.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Saves pages from the mock Canvas server through the render pool with the real SingleFile and Chrome, and checks that
+every pooled browser survives the SingleFile runs it serves, so each worker launches Chrome once, and that every page
+is saved with one visit, including the module item links Canvas redirects.
+
+    python benchmarks/check_render.py [--pages N] [--modules N] [--workers N] [--batch-size N] [--keep]
+
+Needs SingleFile installed with npm in the repository and Chrome at the path set in module/singlefile.py.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from mock_canvas import MockCanvasData, MockCanvasServer
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from module import singlefile  # noqa: E402
+from module.const import global_consts  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the SingleFile render pool against a mock Canvas server.')
+    parser.add_argument('--pages', type=int, default=20, help='Number of wiki pages to save.')
+    parser.add_argument('--modules', type=int, default=2, help='Number of modules whose items are saved.')
+    parser.add_argument('--workers', type=int, default=2, help='Number of pooled browsers.')
+    parser.add_argument('--batch-size', type=int, default=global_consts.RENDER_BATCH_SIZE, help='Max number of pages saved by one SingleFile process.')
+    parser.add_argument('--keep', action='store_true', help="Don't delete the saved pages.")
+    args = parser.parse_args()
+
+    # SingleFile is looked up relative to the repository.
+    os.chdir(REPO_ROOT)
+    missing = [path for path in (singlefile.SINGLEFILE_BINARY_PATH, singlefile.CHROME_PATH) if not Path(path).exists()]
+    if missing:
+        sys.exit(f'Missing {", ".join(missing)}; install SingleFile and Chrome to run this check.')
+
+    server = MockCanvasServer(MockCanvasData(courses=1, pages=args.pages, modules=args.modules)).start()
+    work_dir = Path(tempfile.mkdtemp(prefix='canvas-check-render-'))
+    try:
+        global_consts.COOKIES_PATH = work_dir / 'cookies.txt'
+        global_consts.COOKIES_PATH.write_text('# Netscape HTTP Cookie File\n')
+        global_consts.RENDER_BATCH_SIZE = max(1, args.batch_size)
+        output = work_dir / 'pages'
+
+        pool = singlefile.start_render_pool(args.workers)
+        urls = [f'{server.data.base_url}/courses/1/pages/page-{n}' for n in range(args.pages)]
+        urls += [item['html_url'] for n in range(args.modules) for item in server.data.module(1, n)['items']]
+        futures = [singlefile.submit_page(url, output, f'{n}.html') for n, url in enumerate(urls)]
+        singlefile.wait_pages(futures)
+        singlefile.stop_render_pool()
+
+        saved = sum(1 for future in futures if not future.exception() and future.result())
+        visited_again = [url for url in urls if server.urls.get(urlsplit(url).path, 0) > 1]
+        print(f'pages saved:       {saved}/{len(urls)}')
+        print(f'visited again:     {len(visited_again)}' + ''.join(f'\n  {url}' for url in visited_again))
+        print(f'browser launches:  {pool.browser_launches} for {pool.size} workers')
+        print(f'browsers reused:   {pool.reuse_browsers}')
+        ok = saved == len(urls) and not visited_again and pool.reuse_browsers and pool.browser_launches <= pool.size
+        print('OK' if ok else 'FAILED')
+        sys.exit(0 if ok else 1)
+    finally:
+        server.shutdown()
+        if args.keep:
+            print('Pages kept in', work_dir)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""
+A stand-in Canvas server for benchmarks. It serves the REST endpoints the exporter uses with synthetic, deterministic
+data, file downloads with Range support and plain HTML pages for SingleFile, and counts the requests and bytes it
+serves.
+
+    python benchmarks/mock_canvas.py [--port N] [--courses N] [--assignments N] ...
+"""
+import argparse
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+DATE = '2024-01-15T12:00:00Z'
+DEFAULT_PER_PAGE = 10
+MAX_PER_PAGE = 100
+USER_ID = 1
+LOREM = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. '
+
+
+class MockCanvasData:
+    """
+    The synthetic contents of the account. Every course has the same shape; ids are derived from the course id so
+    nothing has to be stored.
+    """
+
+    def __init__(self, courses=3, assignments=20, modules=5, items=6, pages=10, discussions=5, announcements=5,
+                 posts=20, files=10, file_size=256 * 1024, html_size=20 * 1024):
+        self.courses = courses
+        self.assignments = assignments
+        self.modules = modules
+        self.items = items
+        self.pages = pages
+        self.discussions = discussions
+        self.announcements = announcements
+        self.posts = posts
+        self.files = files
+        self.file_size = file_size
+        self.html_size = html_size
+        self.base_url = ''
+
+    @staticmethod
+    def _id(course_id, kind, n):
+        return course_id * 100000 + kind * 10000 + n
+
+    def course(self, course_id):
+        return {
+            'id': course_id, 'name': f'Benchmark Course {course_id}', 'course_code': f'BENCH{course_id}',
+            'workflow_state': 'available', 'created_at': DATE, 'term': {'id': 1, 'name': 'Benchmark Term'},
+        }
+
+    def course_ids(self):
+        return list(range(1, self.courses + 1))
+
+    def body(self, course_id, n):
+        # Link a couple of the course files like real pages do.
+        links = ''.join(f'<p><a href="/courses/{course_id}/files/{self.file(course_id, (n + k) % self.files)["id"]}/download">file</a></p>' for k in range(2)) if self.files else ''
+        return '<p>' + LOREM * 4 + '</p>' + links
+
+    def file(self, course_id, n):
+        file_id = self._id(course_id, 1, n)
+        return {
+            'id': file_id, 'display_name': f'file-{n}.pdf', 'filename': f'file-{n}.pdf', 'size': self.file_size,
+            'content-type': 'application/pdf', 'folder_id': course_id, 'updated_at': DATE, 'created_at': DATE,
+            'url': f'{self.base_url}/files/{file_id}/download?download_frd=1&verifier=bench',
+        }
+
+    def course_files(self, course_id):
+        return [self.file(course_id, n) for n in range(self.files)]
+
+    def page(self, course_id, n, body=True):
+        page = {
+            'page_id': self._id(course_id, 2, n), 'url': f'page-{n}', 'title': f'Page {n}', 'created_at': DATE,
+            'updated_at': DATE, 'html_url': f'{self.base_url}/courses/{course_id}/pages/page-{n}',
+        }
+        if body:
+            page['body'] = self.body(course_id, n)
+        return page
+
+    def assignment(self, course_id, n):
+        assignment_id = self._id(course_id, 3, n)
+        return {
+            'id': assignment_id, 'course_id': course_id, 'name': f'Assignment {n}', 'description': self.body(course_id, n),
+            'due_at': DATE, 'updated_at': DATE, 'points_possible': 10, 'submission_types': ['online_upload'],
+            'html_url': f'{self.base_url}/courses/{course_id}/assignments/{assignment_id}',
+            'submission': self.submission(course_id, assignment_id),
+        }
+
+    def submission(self, course_id, assignment_id):
+        return {
+            'id': assignment_id, 'assignment_id': assignment_id, 'user_id': USER_ID, 'workflow_state': 'graded',
+            'submitted_at': DATE, 'graded_at': DATE, 'score': 9, 'grade': '9', 'attempt': 1, 'attachments': [],
+            'preview_url': f'{self.base_url}/courses/{course_id}/assignments/{assignment_id}/submissions/{USER_ID}?preview=1',
+        }
+
+    def module(self, course_id, n):
+        module_id = self._id(course_id, 4, n)
+        items = []
+        for i in range(self.items):
+            item_id = module_id * 100 + i
+            kind = ('Page', 'File', 'Assignment')[i % 3]
+            item = {'id': item_id, 'module_id': module_id, 'position': i, 'title': f'Item {n}.{i}', 'type': kind, 'indent': 0}
+            if kind == 'Page' and self.pages:
+                item['page_url'] = f'page-{(n + i) % self.pages}'
+                item['url'] = f'{self.base_url}/api/v1/courses/{course_id}/pages/{item["page_url"]}'
+            elif kind == 'File' and self.files:
+                item['content_id'] = self.file(course_id, (n + i) % self.files)['id']
+                item['url'] = f'{self.base_url}/api/v1/courses/{course_id}/files/{item["content_id"]}'
+            elif kind == 'Assignment' and self.assignments:
+                item['content_id'] = self._id(course_id, 3, (n + i) % self.assignments)
+                item['url'] = f'{self.base_url}/api/v1/courses/{course_id}/assignments/{item["content_id"]}'
+            else:
+                continue
+            item['html_url'] = f'{self.base_url}/courses/{course_id}/modules/items/{item_id}'
+            items.append(item)
+        return {'id': module_id, 'name': f'Module {n}', 'position': n, 'items_count': len(items), 'items': items}
+
+    def module_item_url(self, course_id, item_id):
+        # Canvas sends module item links on to the page, file or assignment they point at.
+        for item in self.module(course_id, item_id // 100 % 10000)['items']:
+            if item['id'] == item_id:
+                return item['url'].replace('/api/v1', '', 1) + f'?module_item_id={item_id}'
+        return None
+
+    def topic(self, course_id, n, announcement=False):
+        topic_id = self._id(course_id, 6 if announcement else 5, n)
+        return {
+            'id': topic_id, 'course_id': course_id, 'title': f'{"Announcement" if announcement else "Discussion"} {n}',
+            'message': self.body(course_id, n), 'user_name': 'Teacher', 'created_at': DATE, 'posted_at': DATE,
+            'updated_at': DATE, 'last_reply_at': DATE, 'discussion_subentry_count': self.posts,
+            'html_url': f'{self.base_url}/courses/{course_id}/discussion_topics/{topic_id}', 'is_announcement': announcement,
+        }
+
+    def topic_view(self, course_id, topic_id):
+        # Every other post is a reply to the one before it.
+        view = []
+        for n in range(self.posts):
+            entry = {'id': topic_id * 1000 + n, 'user_id': USER_ID, 'created_at': DATE, 'message': '<p>' + LOREM * 2 + '</p>', 'replies': []}
+            if n % 2 and view:
+                view[-1]['replies'].append(entry)
+            else:
+                view.append(entry)
+        return {'participants': [{'id': USER_ID, 'display_name': 'Student'}], 'view': view, 'new_entries': []}
+
+    def html_page(self, path):
+        filler = '<p>' + LOREM * 8 + '</p>'
+        body = filler * max(1, self.html_size // len(filler))
+        return f'<!DOCTYPE html><html><head><title>{path}</title></head><body><div class="profileContent__Block">{body}</div></body></html>'
+
+
+class MockCanvasHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server: MockCanvasServer = self.server
+        parts = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        server.count_request(self.path)
+
+        if parts.path.startswith('/api/v1/'):
+            result = server.route(parts.path[len('/api/v1'):], query)
+            if result is None:
+                return self.send_body(404, json.dumps({'errors': [{'message': 'The specified resource does not exist.'}]}).encode(), 'application/json')
+            if isinstance(result, list):
+                return self.send_list(parts.path, query, result)
+            return self.send_body(200, json.dumps(result).encode(), 'application/json')
+
+        m = re.match(r'^/files/(\d+)/download$', parts.path)
+        if m:
+            return self.send_file(int(m.group(1)))
+
+        m = re.match(r'^/courses/(\d+)/modules/items/(\d+)$', parts.path)
+        location = m and server.data.module_item_url(int(m.group(1)), int(m.group(2)))
+        if location:
+            return self.send_body(302, b'', 'text/html; charset=utf-8', {'Location': location})
+
+        return self.send_body(200, server.data.html_page(parts.path).encode(), 'text/html; charset=utf-8')
+
+    def send_list(self, path, query, items):
+        # Paginate like Canvas, with the page links in the Link header.
+        per_page = min(MAX_PER_PAGE, int(query.get('per_page', DEFAULT_PER_PAGE)))
+        page = int(query.get('page', 1))
+        last = max(1, -(-len(items) // per_page))
+        links = []
+        for rel, n in (('current', page), ('next', page + 1), ('first', 1), ('last', last)):
+            if rel == 'next' and page >= last:
+                continue
+            link_query = urlencode({**query, 'page': n, 'per_page': per_page})
+            links.append(f'<{self.server.data.base_url}{path}?{link_query}>; rel="{rel}"')
+        body = json.dumps(items[(page - 1) * per_page:page * per_page]).encode()
+        self.send_body(200, body, 'application/json', {'Link': ','.join(links)})
+
+    def send_file(self, file_id):
+        size = self.server.data.file_size
+        start = 0
+        status = 200
+        headers = {'Accept-Ranges': 'bytes'}
+        m = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if m:
+            start = int(m.group(1))
+            if start >= size:
+                return self.send_body(416, b'', 'text/plain', {'Content-Range': f'bytes */{size}'})
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{size - 1}/{size}'
+        # Derived from the id so every copy of a file has the same content.
+        chunk = (str(file_id) * 64).encode()[:64]
+        data = (chunk * (size // len(chunk) + 1))[start:size]
+        self.send_body(status, data, 'application/octet-stream', headers)
+
+    def send_body(self, status, body: bytes, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Rate-Limit-Remaining', '700.0')
+        self.send_header('X-Request-Cost', '0.1')
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count_bytes(len(body))
+
+
+class MockCanvasServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, data: MockCanvasData, port=0):
+        super().__init__(('127.0.0.1', port), MockCanvasHandler)
+        self.data = data
+        self.data.base_url = f'http://127.0.0.1:{self.server_port}'
+        self._lock = threading.Lock()
+        self.reset_stats()
+        self.routes = [
+            (r'/courses', lambda q: [self.data.course(c) for c in self.data.course_ids()]),
+            (r'/courses/(\d+)', lambda q, c: self.data.course(c) if c in self.data.course_ids() else None),
+            (r'/courses/(\d+)/modules', lambda q, c: [self.data.module(c, n) for n in range(self.data.modules)]),
+            (r'/courses/(\d+)/modules/(\d+)/items', lambda q, c, m: self.data.module(c, m % 10000)['items']),
+            (r'/courses/(\d+)/pages', lambda q, c: [self.data.page(c, n, body=False) for n in range(self.data.pages)]),
+            (r'/courses/(\d+)/pages/page-(\d+)', lambda q, c, n: self.data.page(c, n)),
+            (r'/courses/(\d+)/assignments', lambda q, c: [self.data.assignment(c, n) for n in range(self.data.assignments)]),
+            (r'/courses/(\d+)/assignments/(\d+)', lambda q, c, a: self.data.assignment(c, a % 10000)),
+            (r'/courses/(\d+)/assignments/(\d+)/submissions/(\w+)', lambda q, c, a, u: self.data.submission(c, a)),
+            (r'/courses/(\d+)/discussion_topics', self._topics),
+            (r'/courses/(\d+)/discussion_topics/(\d+)/view', lambda q, c, t: self.data.topic_view(c, t)),
+            (r'/courses/(\d+)/discussion_topics/(\d+)/entries', lambda q, c, t: []),
+            (r'/courses/(\d+)/files', lambda q, c: self.data.course_files(c)),
+            (r'/courses/(\d+)/files/(\d+)', lambda q, c, f: self.data.file(c, f % 10000)),
+            (r'/courses/(\d+)/folders/(\d+)', lambda q, c, f: {'id': f, 'name': 'course files', 'full_name': 'course files'}),
+            (r'/files/(\d+)', lambda q, f: self.data.file(f // 100000, f % 10000)),
+            (r'/users/(?:self|\d+)', lambda q: {'id': USER_ID, 'name': 'Student'}),
+            (r'/users/(?:self|\d+)/folders', lambda q: [{'id': 0, 'name': 'my files', 'full_name': 'my files'}, {'id': 1, 'name': 'notes', 'full_name': 'my files/notes'}]),
+            (r'/folders/(\d+)/files', lambda q, f: self.data.course_files(f) if f else []),
+        ]
+        self.routes = [(re.compile('^' + pattern + '$'), handler) for pattern, handler in self.routes]
+
+    def _topics(self, query, course_id):
+        announcements = query.get('only_announcements') in ('true', 'True', '1')
+        count = self.data.announcements if announcements else self.data.discussions
+        return [self.data.topic(course_id, n, announcements) for n in range(count)]
+
+    def route(self, path, query):
+        for pattern, handler in self.routes:
+            m = pattern.match(path)
+            if m:
+                return handler(query, *(int(g) if g.isdigit() else g for g in m.groups()))
+        return None
+
+    def reset_stats(self):
+        with self._lock:
+            self.request_count = 0
+            self.bytes_sent = 0
+            self.endpoints = {}
+            self.urls = {}
+
+    def count_request(self, url):
+        endpoint = re.sub(r'/\d+', '/:id', urlsplit(url).path)
+        with self._lock:
+            self.request_count += 1
+            self.endpoints[endpoint] = self.endpoints.get(endpoint, 0) + 1
+            self.urls[url] = self.urls.get(url, 0) + 1
+
+    def count_bytes(self, count):
+        with self._lock:
+            self.bytes_sent += count
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='mock-canvas', daemon=True).start()
+        return self
+
+
+def add_data_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--courses', type=int, default=3, help='Number of courses.')
+    parser.add_argument('--assignments', type=int, default=20, help='Assignments per course.')
+    parser.add_argument('--modules', type=int, default=5, help='Modules per course.')
+    parser.add_argument('--items', type=int, default=6, help='Items per module.')
+    parser.add_argument('--pages', type=int, default=10, help='Wiki pages per course.')
+    parser.add_argument('--discussions', type=int, default=5, help='Discussions per course.')
+    parser.add_argument('--announcements', type=int, default=5, help='Announcements per course.')
+    parser.add_argument('--posts', type=int, default=20, help='Posts in each discussion and announcement.')
+    parser.add_argument('--files', type=int, default=10, help='Files per course.')
+    parser.add_argument('--file-size', type=int, default=256 * 1024, help='Size of each file in bytes.')
+    parser.add_argument('--html-size', type=int, default=20 * 1024, help='Approximate size of each HTML page in bytes.')
+
+
+def data_from_args(args) -> MockCanvasData:
+    return MockCanvasData(args.courses, args.assignments, args.modules, args.items, args.pages, args.discussions,
+                          args.announcements, args.posts, args.files, args.file_size, args.html_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a mock Canvas server.')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on.')
+    add_data_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockCanvasServer(data_from_args(args), args.port)
+    print('Mock Canvas listening on', server.data.base_url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,56 +1,221 @@
 import argparse
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from http.cookiejar import MozillaCookieJar
 from pathlib import Path
 
 import canvasapi
-import requests
 import yaml
 from canvasapi import Canvas
 
+from module.api.file import drop_file_cache
+from module.assets import start_asset_pool, stop_asset_pool
+from module.api.paginate import fetch_all
 from module.const import global_consts
+from module.crawler import crawl_course
+from module.httpcache import get_response_cache, install_response_cache
 from module.download_canvas import download_assignments, download_course_modules, download_course_grades_page, download_course_announcement_pages, download_course_home_page_html, download_course_discussion_pages
-from module.get_canvas import find_course_pages, find_course_modules, find_course_assignments, find_course_announcements, find_course_discussions
-from module.items import CanvasCourse, jsonify_anything
-from module.singlefile import download_page
+from module import journal
+from module.items import CanvasCourse
+from module.manifest import get_manifest
+from module.metrics import run_metrics
+from module.scheduler import CourseFailed, CourseScheduler, limit_api_requests
+from module.serialize import to_data
+from module.singlefile import start_render_pool, stop_render_pool, submit_page, wait_pages
+from module.stream import MetadataStream, compact_stream
+from module.transport import get_session, install_canvas_transport
 from module.user_files import download_user_files
 
 SCRIPT_PATH = os.path.abspath(os.path.dirname(__file__))
 
 
-def export_all_course_data(c):
-    json_data = jsonify_anything(c)
-    course_output_dir = os.path.join(OUTPUT_LOCATION, c.term, c.name)
-    if not os.path.exists(course_output_dir):
-        os.makedirs(course_output_dir)
-    course_output_path = os.path.join(course_output_dir, c.name + ".json")
-    with open(course_output_path, "w") as file:
-        file.write(json_data)
+def export_course(course):
+    if not hasattr(course, "name") or not hasattr(course, "term"):
+        return None
+
+    resolved_canvas_course = CanvasCourse(course)
+
+    if args.term and args.term != resolved_canvas_course.term:
+        print('Skipping term:', resolved_canvas_course.term, '\n')
+        return None
+
+    course_id = resolved_canvas_course.course_id
+    if journal.is_done('course', course_id):
+        print(f"=== Already exported {resolved_canvas_course.term}: {resolved_canvas_course.name} ===\n")
+        return course_id
+
+    print(f"=== {resolved_canvas_course.term}: {resolved_canvas_course.name} ===")
+    journal.record('course', course_id, journal.PENDING, course_id)
+    course_start = time.perf_counter()
+
+    with run_metrics.phase('probe', course_id):
+        # Offline there's nothing to probe, the cache has whatever it has.
+        valid, r = resolved_canvas_course.test_course(global_consts.API_URL) if not global_consts.OFFLINE else (True, None)
+    if not valid:
+        reason = f'could not reach the course: {r}' if isinstance(r, Exception) else f'invalid course: {course_id} - {r} - {r.text}'
+        journal.record('probe', course_id, journal.FAILED, course_id, reason)
+        raise CourseFailed(reason)
+    journal.record('probe', course_id, journal.DONE, course_id)
+
+    manifest = get_manifest(OUTPUT_LOCATION / resolved_canvas_course.term / resolved_canvas_course.name)
+
+    # Queue the course pages that don't depend on metadata so they render while the metadata is fetched.
+    print('Downloading course home page and grades...')
+    course_page_futures = [
+        download_course_home_page_html(resolved_canvas_course),
+        download_course_grades_page(resolved_canvas_course),
+    ]
+
+    # Start downloading each kind of content as soon as its metadata is in, while the rest is still being fetched.
+    stage_downloads = {
+        'assignments': download_assignments,
+        'modules': download_course_modules,
+        'announcements': download_course_announcement_pages,
+        'discussions': download_course_discussion_pages,
+    }
+    # What each stage records in the manifest: the kinds of entries, and the directory its files are saved under.
+    stage_outputs = {
+        'assignments': (('assignment', 'submission'), 'assignments'),
+        'modules': (('module_item',), 'modules'),
+        'announcements': (('announcement',), 'announcements'),
+        'discussions': (('discussion',), 'discussions'),
+        'pages': (('page',), None),
+    }
+    # Every record goes to this course's own stream and from there to the combined one. The course JSON is built
+    # from it at the end, so each stage can be dropped from memory as soon as its files are downloaded.
+    manifest.course_dir.mkdir(parents=True, exist_ok=True)
+    course_stream_path = manifest.course_dir / (resolved_canvas_course.name + ".ndjson")
+    course_stream = MetadataStream(course_stream_path, mirror=metadata_stream)
+    # Every stage is journaled before the crawl starts, so an interrupted run lists the ones it never finished.
+    for stage in stage_outputs:
+        journal.record('metadata', f'{course_id}:{stage}', journal.PENDING, course_id)
+    crawl_start = time.perf_counter()
+    try:
+        course_stream.write_course(resolved_canvas_course)
+        for stage, results, complete in crawl_course(course, manifest=manifest):
+            if not complete:
+                # Whatever couldn't be listed this time may well still be on Canvas, so don't flag or prune it.
+                kinds, directory = stage_outputs[stage]
+                manifest.keep(kinds=kinds)
+                if directory:
+                    manifest.keep(directory=manifest.course_dir / directory)
+            setattr(resolved_canvas_course, stage, results)
+            course_stream.write_items(stage, course_id, results)
+            journal.record('metadata', f'{course_id}:{stage}', journal.DONE, course_id)
+            if stage in stage_downloads and not global_consts.OFFLINE:
+                with run_metrics.phase(f'download_{stage}', course_id):
+                    stage_downloads[stage](resolved_canvas_course)
+            if stage == 'pages':
+                # Pages are only exported as metadata, but tracking them lets us report the ones removed from Canvas.
+                for page in results:
+                    manifest.record('page', page.id, page.last_updated_date)
+            setattr(resolved_canvas_course, stage, [])
+    finally:
+        course_stream.close()
+    # Includes the stage downloads, which overlap with fetching the rest of the metadata.
+    run_metrics.add_phase('crawl', time.perf_counter() - crawl_start, course_id)
+
+    # TODO: nothing to test this on
+    # download_course_files(course)
+
+    with run_metrics.phase('wait_pages', course_id):
+        wait_pages(course_page_futures)
+
+    # Nothing was checked against the files on disk in offline mode, so the manifest can't tell what's missing.
+    if not global_consts.OFFLINE:
+        missing = manifest.finish(prune=args.prune)
+        if missing:
+            print(f"{'Removed' if args.prune else 'Flagged'} {len(missing)} item(s) that are no longer on Canvas.")
+
+    print("Exporting course metadata...")
+    with run_metrics.phase('export_json', course_id):
+        compact_stream(course_stream_path, manifest.course_dir / (resolved_canvas_course.name + ".json"), single_course=True)
+    course_stream_path.unlink()
+
+    drop_file_cache(course)
+    journal.record('course', course_id, journal.DONE, course_id)
+    run_metrics.add_phase('total', time.perf_counter() - course_start, course_id)
+
+    print(f"=== Finished {resolved_canvas_course.term}: {resolved_canvas_course.name} ===\n")
+    # Everything about the course is on disk now, so don't hold on to it.
+    return course_id
+
+
+def check_frontend():
+    """
+    Make sure the cookies log us in to the Canvas frontend. Returns what's wrong, or None if they work.
+    """
+    with run_metrics.phase('frontend_auth'):
+        r = get_session().get(f'{global_consts.API_URL}/profile')
+    if r.status_code != 200:
+        return f'Failed to fetch Canvas profile: got status code {r.status_code}'
+    if not r.url.startswith(global_consts.API_URL):
+        return f'Failed to fetch Canvas profile: client was redirected away from Canvas:\n{r.url}'
+    if 'profileContent__Block' not in r.text:
+        # TODO: add an arg to skip this check.
+        return 'Failed to test Canvas profile: could not find an element with the class "profileContent__Block". This could mean that your authentication is incorrect.'
+    return None
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='')
     parser.add_argument('--output', default='./output', help='Output location. If it does not exist, it will be created.')
     parser.add_argument('--term', default=None, help='Only download this term.')
+    parser.add_argument('--credentials', default=Path(SCRIPT_PATH, 'credentials.yaml'), help='Path to the credentials file.')
+    parser.add_argument('--no-html', action='store_true', help="Don't save any HTML pages with SingleFile, only the metadata and files.")
+    parser.add_argument('--fast-render', action='store_true', help='Build assignment, wiki page, announcement and discussion pages from the API data instead of rendering them in the browser. The browser is still used for pages without an API equivalent.')
+    parser.add_argument('--dedup-assets', action='store_true', help='Store the stylesheets, fonts and images inlined in saved pages once in a shared _assets directory instead of in every page.')
     parser.add_argument('--user-files', action='store_true', help="Download the user files.")
+    parser.add_argument('--render-workers', type=int, default=global_consts.RENDER_WORKERS, help='Number of headless browsers to keep open for saving HTML pages.')
+    parser.add_argument('--render-batch-size', type=int, default=global_consts.RENDER_BATCH_SIZE, help='Max number of pages to save with one SingleFile process.')
+    parser.add_argument('--prune', action='store_true', help='Delete exported files for items that were removed from Canvas instead of only flagging them in the manifest.')
+    parser.add_argument('--refetch-assignments', action='store_true', help='Fetch every assignment on its own instead of trusting the bulk listing. Slower, but matches older versions.')
+    parser.add_argument('--no-compact', action='store_true', help="Only write the streamed all_output.ndjson and skip building the combined all_output.json from it.")
+    parser.add_argument('--offline', action='store_true', help='Rebuild the metadata JSON from cached API responses only, without contacting Canvas or downloading pages and files.')
+    parser.add_argument('--no-cache', action='store_true', help="Don't cache API responses.")
+    parser.add_argument('--cache-ttl', type=float, default=global_consts.HTTP_CACHE_TTL, help='Seconds a cached API response is used without checking with Canvas whether it changed.')
+    parser.add_argument('--resume', action='store_true', help='Continue an export that was interrupted, skipping the courses, pages and files it already finished.')
+    parser.add_argument('--journal', action='store_true', help='Show what the last export finished and what it left pending, then exit.')
+    parser.add_argument('--profile', action='store_true', help='Profile the metadata fetching with cProfile and save the result to metadata.prof in the output directory.')
+    parser.add_argument('--chunk-size', type=int, default=global_consts.DOWNLOAD_CHUNK_SIZE // 1024, help='Size in KiB of the chunks files are downloaded in.')
+    parser.add_argument('--course-workers', type=int, default=1, help='Number of courses to export at the same time.')
+    parser.add_argument('--api-workers', type=int, default=global_consts.API_WORKERS, help='Max number of Canvas API requests and file downloads in flight at once, shared by all courses. Fewer are sent while the Canvas rate limit budget is low.')
     args = parser.parse_args()
 
     OUTPUT_LOCATION = Path(args.output).resolve().expanduser().absolute()
     OUTPUT_LOCATION.mkdir(parents=True, exist_ok=True)
+    global_consts.OUTPUT_LOCATION = OUTPUT_LOCATION
+
+    if args.journal:
+        journal.print_journal(OUTPUT_LOCATION)
+        quit(0)
 
     # Startup checks.
-    creds_file = Path(SCRIPT_PATH, 'credentials.yaml')
+    creds_file = Path(args.credentials)
     if not creds_file.is_file():
-        print('The credentials.yaml file does not exist:', creds_file)
+        print('The credentials file does not exist:', creds_file)
         quit(1)
 
-    with open("credentials.yaml", 'r') as f:
+    with open(creds_file, 'r') as f:
         credentials = yaml.full_load(f)
 
     global_consts.API_URL = credentials["API_URL"]
     global_consts.API_KEY = credentials["API_KEY"]
     global_consts.USER_ID = credentials["USER_ID"]
+    global_consts.RENDER_WORKERS = max(1, args.render_workers)
+    global_consts.RENDER_BATCH_SIZE = max(1, args.render_batch_size)
+    global_consts.API_WORKERS = max(1, args.api_workers)
+    global_consts.COURSE_WORKERS = max(1, args.course_workers)
+    global_consts.REFETCH_ASSIGNMENTS = args.refetch_assignments
+    global_consts.DOWNLOAD_CHUNK_SIZE = max(8, args.chunk_size) * 1024
+    run_metrics.profiling = args.profile
+    global_consts.OFFLINE = args.offline
+    global_consts.SAVE_HTML = not args.no_html and not args.offline
+    global_consts.FAST_RENDER = args.fast_render
+    global_consts.DEDUP_ASSETS = args.dedup_assets
+    global_consts.HTTP_CACHE_TTL = max(0.0, args.cache_ttl)
     global_consts.COOKIES_PATH = str(Path(credentials["COOKIES_PATH"]).resolve().expanduser().absolute())
 
     if not Path(global_consts.COOKIES_PATH).is_file():
@@ -68,43 +233,42 @@ if __name__ == "__main__":
         print("Creating output directory:", OUTPUT_LOCATION)
         os.makedirs(OUTPUT_LOCATION)
 
-    if global_consts.COOKIES_PATH:
-        # Test the cookies.
-        print("Authenticating with Canvas frontend...")
-
-        # Requests takes a dict, not the MozillaCookieJar object.
-        request_cookies = {c.name: c.value for c in global_consts.COOKIE_JAR}
-
-        r = requests.get(f'{global_consts.API_URL}/profile', headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'}, cookies=request_cookies)
-        if r.status_code != 200:
-            print('Failed to fetch Canvas profile: got status code', r.status_code)
-            quit(1)
-        if not r.url.startswith(global_consts.API_URL):
-            print('Failed to fetch Canvas profile: client was redirected away from Canvas:')
-            print(r.url)
-            quit(1)
-        if 'profileContent__Block' not in r.text:
-            # TODO: add an arg to skip this check.
-            print('Failed to test Canvas profile: could not find an element with the class "profileContent__Block". This could mean that your authentication is incorrect.')
-            quit(1)
-
-        # TODO: log debug status success here
-    else:
+    if not global_consts.COOKIES_PATH:
         print('No cookies file specified! No HTML pages will be saved.')
 
     print("Authenticating with Canvas API...")
     canvas = Canvas(global_consts.API_URL, global_consts.API_KEY)
-    courses = canvas.get_courses(include="term")
-    try:
-        course_count = len(list(courses))
-    except canvasapi.exceptions.InvalidAccessToken as e:
+    api_session = install_canvas_transport(canvas)
+    response_cache = None
+    if not args.no_cache or args.offline:
+        response_cache = install_response_cache(api_session, get_response_cache(offline=args.offline))
+    api_limiter = limit_api_requests(canvas, global_consts.API_WORKERS)
+
+    # The frontend check and the course listing don't depend on each other, so run them at the same time.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        frontend_check = None
+        if global_consts.COOKIES_PATH and not global_consts.OFFLINE:
+            print("Authenticating with Canvas frontend...")
+            frontend_check = executor.submit(check_frontend)
+
         try:
-            msg = e.message[0]['message']
-        except:
-            # Something went very wrong.
-            msg = ''
-        print('Failed to fetch courses from the Canvas API:', msg)
-        quit(1)
+            with run_metrics.phase('list_courses'):
+                # The only time the course list is fetched, everything below reuses it.
+                courses = fetch_all(canvas.get_courses(include=['term'], per_page=100))
+        except canvasapi.exceptions.InvalidAccessToken as e:
+            try:
+                msg = e.message[0]['message']
+            except:
+                # Something went very wrong.
+                msg = ''
+            print('Failed to fetch courses from the Canvas API:', msg)
+            quit(1)
+
+        if frontend_check is not None:
+            error = frontend_check.result()
+            if error:
+                print(error)
+                quit(1)
 
     print('')
 
@@ -113,75 +277,56 @@ if __name__ == "__main__":
     # ==================================================================================================================
     # Exporting
 
+    journal.open_journal(OUTPUT_LOCATION, resume=args.resume)
+    if global_consts.SAVE_HTML:
+        start_render_pool(global_consts.RENDER_WORKERS)
+        if global_consts.DEDUP_ASSETS:
+            start_asset_pool(global_consts.ASSET_WORKERS)
+
     print("Downloading courses page...")
-    courses_dict = {v['id']: v for v in json.loads(jsonify_anything(courses))['_elements']}
+    courses_dict = {v['id']: v for v in to_data(courses)}
     (global_consts.OUTPUT_LOCATION / 'courses.json').write_text(json.dumps(courses_dict))
-    download_page(global_consts.API_URL + "/courses/", global_consts.OUTPUT_LOCATION, "courses.html")
+    # Rendered alongside the courses rather than holding them up.
+    courses_page_future = submit_page(global_consts.API_URL + "/courses/", global_consts.OUTPUT_LOCATION, "courses.html")
 
-    if args.user_files:
+    if args.user_files and not global_consts.OFFLINE:
         print('Downloading user files...')
-        download_user_files(canvas, OUTPUT_LOCATION / 'User Files')
+        with run_metrics.phase('user_files'):
+            download_user_files(canvas, OUTPUT_LOCATION / 'User Files')
 
     print('')
 
-    all_courses_views = []
-
-    for course in courses:
-        if course.id in skip or not hasattr(course, "name") or not hasattr(course, "term"):
-            continue
-
-        resolved_canvas_course = CanvasCourse(course)
-
-        if args.term and args.term != resolved_canvas_course.term:
-            print('Skipping term:', resolved_canvas_course.term, '\n')
-            continue
-
-        print(f"=== {resolved_canvas_course.term}: {resolved_canvas_course.name} ===")
-
-        valid, r = resolved_canvas_course.test_course(global_consts.API_URL, global_consts.COOKIE_JAR)
-        if not valid:
-            print(f'Invalid course: {resolved_canvas_course.course_id} - {r} - {r.text}')
-            if r.status_code == 401:
-                # We can't recover from this error.
-                quit(1)
-            continue
-
-        resolved_canvas_course.modules = find_course_modules(course)
-        resolved_canvas_course.assignments = find_course_assignments(course)
-        resolved_canvas_course.announcements = find_course_announcements(course)
-        resolved_canvas_course.discussions = find_course_discussions(course)
-        resolved_canvas_course.pages = find_course_pages(course)
-
-        all_courses_views.append(resolved_canvas_course)
-
-        print('Downloading course home page...')
-        download_course_home_page_html(resolved_canvas_course)
-
-        print('Downloading grades...')
-        download_course_grades_page(resolved_canvas_course)
-
-        download_assignments(resolved_canvas_course)
+    # A resumed run keeps the records of the courses that were already finished.
+    metadata_stream = MetadataStream(OUTPUT_LOCATION / "all_output.ndjson", append=args.resume)
 
-        download_course_modules(resolved_canvas_course)
+    scheduler = CourseScheduler(global_consts.COURSE_WORKERS)
+    with run_metrics.phase('courses'):
+        scheduler.run([c for c in courses if c.id not in skip], export_course)
 
-        download_course_announcement_pages(resolved_canvas_course)
+    metadata_stream.close()
 
-        download_course_discussion_pages(resolved_canvas_course)
+    wait_pages([courses_page_future])
+    stop_render_pool()
+    stop_asset_pool()
+    journal.close_journal()
 
-        # TODO: nothing to test this on
-        # download_course_files(course)
+    if run_metrics.assets['pages']:
+        print(f"Shared assets: {run_metrics.assets['pages']} page(s) went from {run_metrics.assets['bytes_before'] / 2 ** 20:.1f} MiB to {run_metrics.assets['bytes_after'] / 2 ** 20:.1f} MiB.")
 
-        print("Exporting course metadata...")
-        export_all_course_data(resolved_canvas_course)
+    limits = api_limiter.snapshot()
+    print(f"API rate limit: ended at {limits['limit']}/{limits['max_concurrent']} request(s) in flight with {limits['remaining']} budget left, throttled {limits['throttled']} time(s).")
 
-        if course_count > 1:
-            print('')
+    if not args.no_compact:
+        print("Building all_output.json...")
+        with run_metrics.phase('compact'):
+            compact_stream(OUTPUT_LOCATION / "all_output.ndjson", OUTPUT_LOCATION / "all_output.json")
 
-    # Remove elements from the course objects that can't be JSON serialized, then format it.
-    json_str = jsonify_anything(all_courses_views)
+    if response_cache is not None:
+        response_cache.evict()
 
-    all_output_path = os.path.join(OUTPUT_LOCATION, "all_output.json")
-    with open(all_output_path, "w") as out_file:
-        out_file.write(json_str)
+    run_metrics.write_report(OUTPUT_LOCATION / 'run_report.json', api_limits=limits, api_cache=response_cache.stats if response_cache else None)
+    print("Run report written to", OUTPUT_LOCATION / 'run_report.json')
+    if args.profile and run_metrics.write_profile(OUTPUT_LOCATION / 'metadata.prof'):
+        print("Profile written to", OUTPUT_LOCATION / 'metadata.prof', "(open it with `python -m pstats`)")
 
     print("\nProcess complete. All canvas data exported!")
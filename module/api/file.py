@@ -1,21 +1,102 @@
-import re
+import threading
+from collections import OrderedDict
 
 import canvasapi
+import requests
 from canvasapi.course import Course
 
-HTML_ITEM_ATTACHED_FILE_RE = re.compile(r'<a .*? data-api-endpoint=\"(.*?)\" .*?>')
-CANVAS_API_FILE_ID_RE = re.compile(r'.*?/api/v1/courses/.*?/files/(.*?)$')
+from module.api.references import extract_references
+from module.const import global_consts
+
+
+class FileCache:
+    """
+    Bounded cache of a course's file metadata. It is filled from a single listing of the course's files when the
+    course allows that, and otherwise from individual lookups as files are asked for.
+    """
+
+    def __init__(self, course: Course, max_size: int = None):
+        self.course = course
+        self.max_size = max_size or global_consts.FILE_CACHE_SIZE
+        self._files = OrderedDict()
+        self._missing = set()
+        self._lock = threading.Lock()
+        self._warm_lock = threading.Lock()
+        self._warmed = False
+
+    def _put(self, file_id, file):
+        with self._lock:
+            self._files[file_id] = file
+            self._files.move_to_end(file_id)
+            while len(self._files) > self.max_size:
+                self._files.popitem(last=False)
+
+    def warm(self):
+        with self._warm_lock:
+            if self._warmed:
+                return
+            try:
+                # Walk the listing a page at a time, so no more of it is loaded than the cache can hold.
+                for file in self.course.get_files(per_page=100):
+                    self._put(file.id, file)
+                    if len(self._files) >= self.max_size:
+                        break
+            except (canvasapi.exceptions.Forbidden, canvasapi.exceptions.Unauthorized, canvasapi.exceptions.ResourceDoesNotExist):
+                # Students often can't list a course's files, but can still look them up one by one.
+                pass
+            except (canvasapi.exceptions.CanvasException, requests.RequestException):
+                # Look files up one by one for now and try the listing again on the next lookup.
+                return
+            self._warmed = True
+
+    def get(self, file_id):
+        try:
+            file_id = int(file_id)
+        except (TypeError, ValueError):
+            pass
+        self.warm()
+
+        with self._lock:
+            if file_id in self._files:
+                self._files.move_to_end(file_id)
+                return self._files[file_id]
+            if file_id in self._missing:
+                return None
+
+        try:
+            file = self.course.get_file(file_id)
+        except canvasapi.exceptions.ResourceDoesNotExist:
+            with self._lock:
+                if len(self._missing) < self.max_size:
+                    self._missing.add(file_id)
+            return None
+        self._put(file_id, file)
+        return file
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_file_cache(course: Course) -> FileCache:
+    with _caches_lock:
+        if course.id not in _caches:
+            _caches[course.id] = FileCache(course)
+        return _caches[course.id]
+
+
+def drop_file_cache(course: Course):
+    with _caches_lock:
+        _caches.pop(course.id, None)
 
 
 def get_embedded_files(course: Course, html: str):
     attached_files = set()
-    file_matches = re.findall(HTML_ITEM_ATTACHED_FILE_RE, html)
-    for match in file_matches:
-        file_id = re.match(CANVAS_API_FILE_ID_RE, match)
-        if file_id:
-            try:
-                canvas_file = course.get_file(file_id.group(1))
-                attached_files.add(canvas_file)
-            except canvasapi.exceptions.ResourceDoesNotExist:
-                continue
+    cache = get_file_cache(course)
+    for reference in extract_references(html):
+        if reference.kind != 'file':
+            continue
+        canvas_file = cache.get(reference.id)
+        if canvas_file is not None:
+            attached_files.add(canvas_file)
     return attached_files
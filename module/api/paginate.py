@@ -0,0 +1,75 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from urllib.parse import parse_qs, urlencode, urlsplit, urlunsplit
+
+from canvasapi.paginated_list import PaginatedList
+
+from module.const import global_consts
+
+# Largest page Canvas will return.
+MAX_PER_PAGE = 100
+
+
+def page_url(url: str, page: int) -> str:
+    parts = urlsplit(url)
+    query = parse_qs(parts.query, keep_blank_values=True)
+    query['page'] = [str(page)]
+    return urlunsplit(parts._replace(query=urlencode(query, doseq=True)))
+
+
+def last_page(response) -> int | None:
+    # Canvas leaves out the last link, or uses opaque bookmarks instead of page numbers, on endpoints where
+    # counting is expensive.
+    last = response.links.get('last')
+    if not last:
+        return None
+    m = re.fullmatch(r'\d+', parse_qs(urlsplit(last['url']).query).get('page', [''])[0])
+    return int(m.group(0)) if m else None
+
+
+def build_elements(paginated: PaginatedList, response) -> list:
+    # Same as PaginatedList does for each page it fetches.
+    data = response.json()
+    if getattr(paginated, '_root', None):
+        data = data[paginated._root]
+    elements = []
+    for element in data:
+        if element is not None:
+            element.update(getattr(paginated, '_extra_attribs', None) or {})
+            elements.append(paginated._content_class(paginated._requester, element))
+    return elements
+
+
+def fetch_all(paginated: PaginatedList, max_workers: int = None) -> List:
+    """
+    Fetch every item of a canvasapi PaginatedList. The first page says how many pages there are through its `last`
+    link, and the rest are then fetched at the same time. Items come back in the same order as iterating the list
+    would give them. Listings without a usable `last` link are walked one page at a time.
+    """
+    if getattr(paginated, '_url_override', None) or not hasattr(paginated, '_first_params'):
+        # Not something we know how to page through ourselves.
+        return list(paginated)
+
+    requester = paginated._requester
+    method = paginated._request_method
+    params = dict(paginated._first_params)
+    params['per_page'] = MAX_PER_PAGE
+
+    response = requester.request(method, paginated._first_url, **params)
+    pages = [build_elements(paginated, response)]
+
+    last = last_page(response)
+    next_link = response.links.get('next')
+    if next_link and last and last > 1:
+        urls = [page_url(next_link['url'], n) for n in range(2, last + 1)]
+        with ThreadPoolExecutor(max_workers=max_workers or global_consts.PAGE_WORKERS, thread_name_prefix='page') as executor:
+            # map() keeps the page order no matter which request finishes first.
+            pages.extend(executor.map(lambda url: build_elements(paginated, requester.request(method, '', _url=url)), urls))
+    else:
+        while next_link:
+            response = requester.request(method, '', _url=next_link['url'])
+            pages.append(build_elements(paginated, response))
+            next_link = response.links.get('next')
+
+    return [item for page in pages for item in page]
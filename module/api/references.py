@@ -0,0 +1,54 @@
+import re
+from typing import List, NamedTuple
+from urllib.parse import urlsplit
+
+from module.const import global_consts
+
+
+class CanvasReference(NamedTuple):
+    # One of 'file', 'page' or 'media'.
+    kind: str
+    id: str
+    # The course the reference points into, if the URL says so.
+    course_id: str | None = None
+
+
+# A single pattern for every kind of reference. A link either names its host, which is captured so links to other sites
+# can be told apart, or is relative to Canvas and starts the attribute value or word it is in, so the path of a URL on
+# another site doesn't match on its own. Each branch starts with '/' or '-', which lets the regex engine skip ahead to
+# candidate positions instead of trying every alternative at every character, and nothing in it can backtrack past the
+# end of a URL.
+REFERENCE_RE = re.compile(
+    r'/(?<![^\s"\'=(:]/)(?:/(?P<host>[^/\s"\'<>]+)/)?(?:api/v1/)?(?:'
+    r'(?:courses/(?P<file_course>\d+)/|users/\d+/|groups/\d+/)?files/(?P<file>\d+)'
+    r'|courses/(?P<page_course>\d+)/pages/(?P<page>[^/?#"\'\s<>]+)'
+    r'|media_objects(?:_iframe)?/(?P<media>[\w-]+)'
+    r')'
+    r'|-media(?:-id|_comment_id)=["\'](?P<media_attr>[\w-]+)'
+)
+
+
+def extract_references(html: str, canvas_host: str = None) -> List[CanvasReference]:
+    """
+    Scan an HTML body once and return every Canvas file, page and media reference in it, in document order and
+    without duplicates. Covers `<a data-api-endpoint>` links, plain `/files/:id` and `/files/:id/download` links,
+    inline `<img>` sources and media objects, either relative or on `canvas_host` (the host of the API URL by default).
+    """
+    if not html:
+        return []
+
+    canvas_host = (canvas_host or urlsplit(global_consts.API_URL).netloc).lower()
+    found = {}
+    # findall() hands back plain tuples, which is a lot cheaper than a match object per reference.
+    for host, file_course, file, page_course, page, media, media_attr in REFERENCE_RE.findall(html):
+        if host and host.lower() != canvas_host:
+            continue
+        if file:
+            key, ref = ('file', file), (file_course or None)
+        elif page:
+            key, ref = ('page', page), (page_course or None)
+        else:
+            key, ref = ('media', media or media_attr), None
+        if key not in found:
+            found[key] = CanvasReference(*key, ref)
+    return list(found.values())
@@ -0,0 +1,141 @@
+import base64
+import binascii
+import hashlib
+import mimetypes
+import multiprocessing
+import os
+import re
+import threading
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+
+from .const import global_consts
+from .metrics import run_metrics
+
+ASSETS_DIR_NAME = '_assets'
+
+DATA_URI_RE = re.compile(r'data:(?P<mime>[\w.+-]+/[\w.+-]+)(?:;[\w.+-]+=[\w.+-]+)*;base64,(?P<data>[A-Za-z0-9+/=]+)')
+STYLE_RE = re.compile(r'<style(?P<attrs>\s[^>]*)?>(?P<css>.*?)</style>', re.IGNORECASE | re.DOTALL)
+CSP_META_RE = re.compile(r'<meta\s[^>]*http-equiv=["\']?content-security-policy["\']?[^>]*>', re.IGNORECASE)
+
+# mimetypes doesn't know some of these, and picks odd extensions for others.
+EXTENSIONS = {
+    'font/woff2': '.woff2',
+    'font/woff': '.woff',
+    'application/font-woff': '.woff',
+    'font/ttf': '.ttf',
+    'font/otf': '.otf',
+    'image/svg+xml': '.svg',
+    'image/jpeg': '.jpg',
+    'text/css': '.css',
+    'application/javascript': '.js',
+    'text/javascript': '.js',
+}
+
+
+def extension(mime: str) -> str:
+    return EXTENSIONS.get(mime) or mimetypes.guess_extension(mime) or '.bin'
+
+
+def store_asset(assets_dir: Path, data: bytes, ext: str) -> str:
+    """
+    Write `data` to the asset store under its hash and return the file name. Pages saved by different processes share
+    the files, so they are only ever created whole and never changed.
+    """
+    name = hashlib.sha256(data).hexdigest() + ext
+    path = assets_dir / name
+    if not path.exists():
+        tmp_path = assets_dir / f'.{name}.{os.getpid()}.tmp'
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    return name
+
+
+def replace_data_uris(text: str, assets_dir: Path, prefix: str, min_size: int) -> str:
+    def replace(m):
+        if len(m.group('data')) < min_size:
+            return m.group(0)
+        try:
+            data = base64.b64decode(m.group('data'), validate=True)
+        except (binascii.Error, ValueError):
+            return m.group(0)
+        return prefix + store_asset(assets_dir, data, extension(m.group('mime').lower()))
+
+    return DATA_URI_RE.sub(replace, text)
+
+
+def externalize_assets(page_path: str, assets_dir: str, min_size: int):
+    """
+    Move the large stylesheets and data URIs SingleFile inlines into a page out to the shared asset store, and point
+    the page at them with relative links so it still opens from disk. Returns the size of the page before and after.
+    Runs in a worker process.
+    """
+    page_path, assets_dir = Path(page_path), Path(assets_dir)
+    assets_dir.mkdir(parents=True, exist_ok=True)
+    original = page_path.read_text(encoding='utf-8')
+    prefix = Path(os.path.relpath(assets_dir, page_path.parent)).as_posix() + '/'
+
+    def replace_style(m):
+        css = m.group('css')
+        if len(css) < min_size:
+            return m.group(0)
+        # The stylesheet lives next to the assets it uses.
+        css = replace_data_uris(css, assets_dir, '', min_size)
+        name = store_asset(assets_dir, css.encode('utf-8'), '.css')
+        return f'<link rel="stylesheet" href="{prefix}{name}"{m.group("attrs") or ""}>'
+
+    html = STYLE_RE.sub(replace_style, original)
+    html = replace_data_uris(html, assets_dir, prefix, min_size)
+    if html == original:
+        return len(original.encode('utf-8')), len(original.encode('utf-8'))
+    # SingleFile's policy only allows inline resources, which would block the extracted ones.
+    html = CSP_META_RE.sub('', html)
+
+    tmp_path = page_path.with_name(f'.{page_path.name}.{os.getpid()}.tmp')
+    tmp_path.write_text(html, encoding='utf-8')
+    os.replace(tmp_path, page_path)
+    return len(original.encode('utf-8')), len(html.encode('utf-8'))
+
+
+_executor: ProcessPoolExecutor | None = None
+_lock = threading.Lock()
+
+
+def start_asset_pool(workers: int = None):
+    global _executor
+    with _lock:
+        if _executor is None:
+            # The export has threads running by the time pages come in, which forked workers don't get along with.
+            _executor = ProcessPoolExecutor(max_workers=workers or global_consts.ASSET_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+
+def stop_asset_pool():
+    """
+    Wait for the pages still being processed and stop the workers.
+    """
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def submit_assets(page_path: Path) -> Future | None:
+    """
+    Queue a saved page to have its inlined assets moved to the shared store. Does nothing unless the pool is running.
+    """
+    with _lock:
+        if _executor is None:
+            return None
+        future = _executor.submit(externalize_assets, str(page_path), str(global_consts.OUTPUT_LOCATION / ASSETS_DIR_NAME), global_consts.ASSET_MIN_SIZE)
+
+    def record_result(f):
+        if f.exception():
+            traceback.print_exception(f.exception())
+        else:
+            run_metrics.add_assets(*f.result())
+
+    future.add_done_callback(record_result)
+    return future
@@ -0,0 +1,84 @@
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from module import journal
+from module.const import global_consts
+
+
+class BlobStore:
+    """
+    Content store for Canvas files keyed by file id and size. Each file is downloaded once and then hardlinked
+    into every place it is saved to, falling back to a copy where hardlinks aren't possible.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    @staticmethod
+    def key(file) -> str:
+        return f"{file.id}-{getattr(file, 'size', None) or 'unknown'}"
+
+    def _lock_for(self, key):
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def blob_path(self, file) -> Path:
+        key = self.key(file)
+        # Fan out by the last digits of the id so a single directory doesn't collect every file on the account.
+        return self.root / key[-2:] / key
+
+    def is_valid(self, file, blob: Path) -> bool:
+        if not blob.is_file():
+            return False
+        size = getattr(file, 'size', None)
+        return size is None or blob.stat().st_size == size
+
+    def fetch(self, file, output: Path, download) -> Path:
+        """
+        Link `file` to `output`, calling `download(file, path)` first if the blob isn't there yet. `download` must only
+        create `path` once the file is complete.
+        """
+        blob = self.blob_path(file)
+        # Only one thread downloads a given file, the rest wait for it and then link to the result.
+        with self._lock_for(self.key(file)):
+            if not self.is_valid(file, blob):
+                blob.parent.mkdir(parents=True, exist_ok=True)
+                journal.record('file', blob.name, journal.PENDING, detail=str(output))
+                try:
+                    download(file, blob)
+                except Exception as e:
+                    journal.record('file', blob.name, journal.FAILED, detail=f'{output}: {e}')
+                    raise
+                journal.record('file', blob.name, journal.DONE, detail=str(output))
+        link_file(blob, Path(output))
+        return output
+
+
+def link_file(src: Path, dst: Path):
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if dst.exists():
+        if os.path.samefile(src, dst):
+            return
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Different filesystem or one without hardlink support.
+        shutil.copyfile(src, dst)
+
+
+_store: BlobStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    global _store
+    with _store_lock:
+        if _store is None or _store.root != global_consts.OUTPUT_LOCATION / '.blobs':
+            _store = BlobStore(global_consts.OUTPUT_LOCATION / '.blobs')
+        return _store
@@ -16,6 +16,79 @@ class GlobalConsts:
     # If a folder exceeds this limit, a "-" will be added to the end to indicate it was shortened ("..." not valid)
     MAX_FOLDER_NAME_SIZE = 70
 
+    # Save HTML pages with SingleFile. Without it only the metadata and files are exported.
+    SAVE_HTML = True
+
+    # Build pages that have the same content in the API (assignments, wiki pages, announcements, discussions) from that
+    # data instead of rendering them in the browser. Inlined images larger than FAST_RENDER_MAX_IMAGE bytes stay links,
+    # and FAST_RENDER_IMAGE_CACHE images are kept in memory for pages that share them.
+    FAST_RENDER = False
+    FAST_RENDER_MAX_IMAGE = 5 * 1024 * 1024
+    FAST_RENDER_IMAGE_CACHE = 64
+
+    # Number of warm headless browsers kept around for SingleFile page renders.
+    RENDER_WORKERS = 3
+
+    # Max number of pages handed to a single SingleFile process through its URL list.
+    RENDER_BATCH_SIZE = 10
+
+    # Move the stylesheets, fonts and images SingleFile inlines into every page out to a shared, content addressed
+    # `_assets` directory, so each copy is only stored once. Inlined data smaller than ASSET_MIN_SIZE bytes stays in the
+    # page. Pages are processed by ASSET_WORKERS processes while the export goes on.
+    DEDUP_ASSETS = False
+    ASSET_MIN_SIZE = 4096
+    ASSET_WORKERS = 2
+
+    # Max number of Canvas API requests in flight at once, shared by every course being exported. The actual number
+    # starts at API_START_WORKERS and follows the rate limit headers Canvas sends back. The download stages get this
+    # many threads too, and leave it to the same limit how many of them talk to Canvas at once.
+    API_WORKERS = 16
+    API_START_WORKERS = 4
+
+    # Pages of a single listing fetched at the same time once the number of pages is known.
+    PAGE_WORKERS = 4
+
+    # Remaining rate limit budget below which fewer requests are sent at once, and above which more are allowed.
+    # Canvas starts every token at 700.
+    RATE_LIMIT_LOW = 150
+    RATE_LIMIT_HIGH = 400
+    # Seconds to wait before lowering the number of requests again.
+    RATE_LIMIT_COOLDOWN = 1.0
+    # Retries of a throttled request, and the base and max of the jittered backoff between them, in seconds.
+    RATE_LIMIT_RETRIES = 5
+    RATE_LIMIT_BACKOFF = 2.0
+    RATE_LIMIT_MAX_BACKOFF = 60.0
+
+    # Number of courses exported at the same time.
+    COURSE_WORKERS = 1
+
+    # HTML bodies longer than this many characters are kept in temporary files instead of memory. 0 disables it.
+    SPILL_THRESHOLD = 16 * 1024
+
+    # Bytes read from the network at a time when downloading files.
+    DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+    # Seconds without data before a download is treated as dropped.
+    DOWNLOAD_TIMEOUT = 60
+    # Retries of a failed download, and the base and max of the jittered backoff between them, in seconds.
+    DOWNLOAD_RETRIES = 5
+    DOWNLOAD_BACKOFF = 1.0
+    DOWNLOAD_MAX_BACKOFF = 30.0
+
+    # Seconds a cached API response is used without asking Canvas whether it changed. After that it is revalidated
+    # with its ETag, which is cheap when nothing changed.
+    HTTP_CACHE_TTL = 0
+    # Size limit of the API response cache in bytes, and seconds after which unused responses are removed.
+    HTTP_CACHE_MAX_BYTES = 512 * 1024 * 1024
+    HTTP_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+    # Only use cached API responses and don't download or save anything.
+    OFFLINE = False
+
+    # Max number of file metadata entries cached per course.
+    FILE_CACHE_SIZE = 2048
+
+    # Fetch every assignment on its own instead of trusting the bulk listing.
+    REFETCH_ASSIGNMENTS = False
+
     COOKIES_PATH = ""
 
     COOKIE_JAR = MozillaCookieJar()
@@ -0,0 +1,136 @@
+import asyncio
+import threading
+from queue import Queue
+
+from canvasapi.course import Course
+from tqdm import tqdm
+
+from module.api.paginate import fetch_all
+from module.const import global_consts
+from module.get_canvas import attach_module_pages, get_course_page_urls, get_discussion_view, list_course_assignments, list_course_modules, module_page_urls, resolve_assignment, resolve_module_page, resolve_page
+from module.items import CanvasModule
+from module.manifest import CourseManifest
+from module.metrics import run_metrics
+
+
+class CourseCrawler:
+    """
+    Fetches the metadata of a course with up to `max_concurrency` API calls in flight at once.
+    canvasapi is blocking, so each call runs in a worker thread and asyncio only does the scheduling.
+    """
+
+    def __init__(self, course: Course, max_concurrency: int = None, manifest: CourseManifest = None):
+        self.course = course
+        self.max_concurrency = max_concurrency or global_consts.API_WORKERS
+        self.manifest = manifest
+        self._semaphore = None
+        # Stages with a listing or item that couldn't be fetched.
+        self.incomplete = set()
+        # Page url -> the task fetching it. Pages linked from modules are in the page listing too, so the modules and
+        # pages stages share one fetch of each page.
+        self._pages = {}
+
+        # Attribute on CanvasCourse, progress bar label, how to list the items and how to resolve each one.
+        self.stages = {
+            'modules': ('Fetching Modules', list_course_modules, lambda m: self._call(CanvasModule, m)),
+            'assignments': ('Fetching Assignments', list_course_assignments, lambda a: self._call(resolve_assignment, self.course, a, self.manifest)),
+            'announcements': ('Fetching Announcements', lambda c: fetch_all(c.get_discussion_topics(only_announcements=True)), lambda t: self._call(get_discussion_view, t)),
+            'discussions': ('Fetching Discussions', lambda c: fetch_all(c.get_discussion_topics()), lambda t: self._call(get_discussion_view, t)),
+            'pages': ('Fetching Pages', get_course_page_urls, self._resolve_page),
+        }
+
+    async def _call(self, func, *args):
+        async with self._semaphore:
+            return await asyncio.to_thread(run_metrics.profiled, func, *args)
+
+    async def _fetch_page(self, url):
+        if url not in self._pages:
+            self._pages[url] = asyncio.ensure_future(self._call(self.course.get_page, url))
+        return await self._pages[url]
+
+    async def _resolve_page(self, url):
+        return resolve_page(await self._fetch_page(url))
+
+    async def _resolve_module_page(self, url):
+        return await self._call(resolve_module_page, self.course, await self._fetch_page(url))
+
+    async def _resolve_one(self, stage, resolver, item, bar):
+        try:
+            return await resolver(item)
+        except Exception as e:
+            tqdm.write(f"Skipping {item} that gave the following error: {e}")
+            self.incomplete.add(stage)
+            return None
+        finally:
+            bar.update()
+
+    async def crawl_stage(self, stage):
+        desc, lister, resolver = self.stages[stage]
+        try:
+            items = await self._call(lister, self.course)
+        except Exception as e:
+            tqdm.write(f"Skipping {stage} that gave the following error: {e}")
+            self.incomplete.add(stage)
+            return []
+
+        bar = tqdm(total=len(items), desc=desc, leave=False)
+        try:
+            # gather() keeps the listing order no matter which calls finish first.
+            results = await asyncio.gather(*(self._resolve_one(stage, resolver, item, bar) for item in items))
+        finally:
+            bar.close()
+        results = [r for r in results if r is not None]
+
+        if stage == 'modules':
+            await self._resolve_module_pages(results)
+        return results
+
+    async def _resolve_module_pages(self, modules):
+        urls = module_page_urls(modules)
+        bar = tqdm(total=len(urls), desc='Fetching Module Pages', leave=False)
+        try:
+            pages = await asyncio.gather(*(self._resolve_one('modules', self._resolve_module_page, url, bar) for url in urls))
+        finally:
+            bar.close()
+        attach_module_pages(modules, {url: page for url, page in zip(urls, pages) if page is not None})
+
+    async def crawl(self, on_stage):
+        """
+        Crawl every stage at once and call `on_stage(stage, results, complete)` as each one finishes. `complete` is
+        False if part of the stage couldn't be fetched, so `results` may be missing items that are still on Canvas.
+        """
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run_stage(stage):
+            return stage, await self.crawl_stage(stage)
+
+        for finished in asyncio.as_completed([run_stage(stage) for stage in self.stages]):
+            stage, results = await finished
+            on_stage(stage, results, stage not in self.incomplete)
+
+
+def crawl_course(course: Course, max_concurrency: int = None, manifest: CourseManifest = None):
+    """
+    Crawl a course in the background and yield `(stage, results, complete)` as each stage finishes, so the caller can start
+    downloading one stage while the others are still being fetched.
+    """
+    results = Queue()
+    done = object()
+
+    def run():
+        try:
+            asyncio.run(CourseCrawler(course, max_concurrency, manifest).crawl(lambda stage, r, complete: results.put((stage, r, complete))))
+        except Exception as e:
+            results.put(e)
+        finally:
+            results.put(done)
+
+    threading.Thread(target=run, name=f'crawl-{course.id}', daemon=True).start()
+
+    while True:
+        item = results.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
@@ -1,21 +1,134 @@
-from http.cookiejar import MozillaCookieJar
+import os
+import random
+import time
+from contextlib import nullcontext
+from pathlib import Path
 
 import requests
+from tqdm import tqdm
 
+from module.blobstore import get_blob_store
+from module.const import global_consts
+from module.manifest import CourseManifest
+from module.metrics import run_metrics
+from module.ratelimit import RATE_LIMIT_MESSAGE, api_slot, api_throttled_backoff
+from module.transport import get_session, get_token_session
 
-def download_file(url, output, cookie_jar: MozillaCookieJar):
-    s = requests.Session()
-    for cookie in cookie_jar:
-        s.cookies.set(cookie.name, cookie.value)
-
-    local_filename = output
-    # NOTE the stream=True parameter below
-    with s.get(url, stream=True) as r:
-        r.raise_for_status()
-        with open(local_filename, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                # If you have chunk encoded response uncomment if
-                # and set chunk_size parameter to None.
-                # if chunk:
-                f.write(chunk)
-    return local_filename
+
+class IncompleteDownload(Exception):
+    pass
+
+
+class RateLimited(Exception):
+    """
+    Canvas answered 403 because the token's rate limit was exceeded, which unlike other 403s is worth retrying.
+    """
+    pass
+
+
+def download_file(url, output, size: int = None, headers: dict = None, slot=nullcontext, session: requests.Session = None):
+    """
+    Download `url` to `output` through a `.part` file that is only moved into place once it is complete. An
+    interrupted download is resumed with a Range request, here or on the next run, and failures are retried with a
+    jittered backoff. A 403 for exceeding the rate limit is retried too, backing off through the API limiter. `size`, if known, is checked against what was received. `slot()` is held while the request is
+    sent, until the response headers are in. The browser session is used unless another `session` is given.
+    """
+    s = session or get_session()
+    output = Path(output)
+    part_path = Path(str(output) + '.part')
+
+    attempt = 0
+    throttled = 0
+    while True:
+        try:
+            _download_part(s, url, part_path, size, headers, slot)
+            break
+        except RateLimited as e:
+            if throttled >= global_consts.RATE_LIMIT_RETRIES:
+                raise
+            delay = api_throttled_backoff(throttled)
+            tqdm.write(f'Download of {output.name} was throttled ({e}), retrying in {delay:.1f}s...')
+            throttled += 1
+            # The limiter only holds back requests waiting for a slot, which this one may not take.
+            time.sleep(delay)
+        except (requests.RequestException, IncompleteDownload) as e:
+            if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code < 500 and e.response.status_code != 429:
+                # Retrying won't change a 403 or 404.
+                raise
+            attempt += 1
+            if attempt > global_consts.DOWNLOAD_RETRIES:
+                raise
+            delay = min(global_consts.DOWNLOAD_MAX_BACKOFF, global_consts.DOWNLOAD_BACKOFF * 2 ** attempt)
+            delay = random.uniform(delay / 2, delay)
+            tqdm.write(f'Download of {output.name} failed ({e}), retrying in {delay:.1f}s...')
+            time.sleep(delay)
+
+    os.replace(part_path, output)
+    return output
+
+
+def _download_part(s, url, part_path: Path, size: int = None, headers: dict = None, slot=nullcontext):
+    offset = part_path.stat().st_size if part_path.is_file() else 0
+    if size is not None and offset > size:
+        # Not the file we were downloading before.
+        part_path.unlink()
+        offset = 0
+    if size is not None and offset == size:
+        return
+
+    request_headers = dict(headers or {})
+    if offset:
+        request_headers['Range'] = f'bytes={offset}-'
+
+    with slot():
+        r = s.get(url, headers=request_headers, stream=True, timeout=global_consts.DOWNLOAD_TIMEOUT)
+    with r:
+        if r.status_code == 416 and offset:
+            # The part file already holds everything the server has.
+            expected = offset
+        else:
+            if r.status_code == 403 and RATE_LIMIT_MESSAGE in r.text:
+                raise RateLimited(f'{r.status_code} {RATE_LIMIT_MESSAGE}')
+            r.raise_for_status()
+            if r.status_code != 206:
+                # The server ignored the Range header and is sending the whole file again.
+                offset = 0
+            length = r.headers.get('Content-Length')
+            expected = offset + int(length) if length is not None and 'Content-Encoding' not in r.headers else None
+            with open(part_path, 'ab' if offset else 'wb') as f:
+                for chunk in r.iter_content(chunk_size=global_consts.DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    run_metrics.add_bytes(len(chunk))
+
+    received = part_path.stat().st_size
+    if expected is not None and received != expected:
+        raise IncompleteDownload(f'got {received} of {expected} bytes')
+    if size is not None and received != size:
+        if received > size:
+            part_path.unlink()
+        raise IncompleteDownload(f'got {received} bytes, Canvas says the file has {size}')
+
+
+def download_canvas_blob(file, output: Path):
+    # Same request canvasapi's File.download makes, but resumable and with retries. It authenticates with the token
+    # alone, so the browser cookies aren't sent along the redirect to the file store. Canvas counts it against the
+    # token's rate limit, so it waits for an API slot; the body itself comes from the file store and doesn't.
+    headers = {'Authorization': f'Bearer {global_consts.API_KEY}'}
+    return download_file(file.url, output, size=getattr(file, 'size', None), headers=headers, slot=api_slot, session=get_token_session())
+
+
+def download_canvas_file(file, output: Path, manifest: CourseManifest = None):
+    """
+    Save a canvasapi File to `output` through the shared blob store, unless the manifest shows the same version
+    is already there.
+    """
+    if manifest is None:
+        return get_blob_store().fetch(file, output, download_canvas_blob)
+
+    # The same file can be saved to several places, so each output location gets its own entry.
+    updated_at = getattr(file, 'updated_at', None)
+    item_id = f'{file.id}:{manifest.relative(output)}'
+    if not manifest.is_current('file', item_id, updated_at, output):
+        get_blob_store().fetch(file, output, download_canvas_blob)
+        manifest.record('file', item_id, updated_at, output)
+    return output
@@ -4,20 +4,26 @@ from functools import partial
 import canvasapi
 from tqdm import tqdm
 
+from module import fastrender
 from module.api.file import get_embedded_files
+from module.api.paginate import fetch_all
 from module.const import global_consts
 from module.helpers import make_valid_filename, make_valid_folder_path, shorten_file_name
-from module.items import CanvasCourse, jsonify_anything
-from module.singlefile import download_page
+from module.download import download_canvas_file
+from module.items import CanvasCourse
+from module.manifest import get_manifest
+from module.serialize import jsonify_anything
+from module.singlefile import submit_page, wait_pages
 from module.threading import download_assignment, download_module_item
 
 
 def download_course_files(course, course_view):
     dl_dir = global_consts.OUTPUT_LOCATION / course_view.term / course_view.name
     dl_dir.mkdir(parents=True, exist_ok=True)
+    manifest = get_manifest(dl_dir)
 
     try:
-        files = list(course.get_files())
+        files = fetch_all(course.get_files())
     except canvasapi.exceptions.Forbidden:
         print('Files view is disabled for this course.')
         return
@@ -28,7 +34,7 @@ def download_course_files(course, course_view):
             folder_dl_dir = dl_dir / make_valid_folder_path(file_folder.full_name)
             folder_dl_dir.mkdir(parents=True, exist_ok=True)
             dl_path = folder_dl_dir / make_valid_filename(str(file.display_name))
-            file.download(dl_path)
+            download_canvas_file(file, dl_path, manifest)
         except Exception as e:
             tqdm.write(f"Skipping {file.display_name} - {e}")
 
@@ -39,9 +45,10 @@ def download_course_discussion_pages(resolved_course: CanvasCourse):
 
     base_discussion_dir = global_consts.OUTPUT_LOCATION / resolved_course.term / resolved_course.name / 'discussions'
     base_discussion_dir.mkdir(parents=True, exist_ok=True)
+    manifest = get_manifest(base_discussion_dir.parent)
 
     # (base_discussion_dir / 'discussions.json').write_text(jsonify_anything(resolved_course.discussions))
-    download_page(global_consts.API_URL + "/courses/" + str(resolved_course.course_id) + "/discussion_topics/", base_discussion_dir, "discussions.html")
+    page_futures = []
 
     for discussion in tqdm(list(resolved_course.discussions), desc='Downloading Discussions'):
         discussion_title = make_valid_filename(str(discussion.title))
@@ -51,14 +58,26 @@ def download_course_discussion_pages(resolved_course: CanvasCourse):
         if not discussion.url:
             continue
 
+        if manifest.is_current('discussion', discussion.id, discussion.updated_at, discussion_dir / "discussion_1.html"):
+            # Its embedded files weren't looked at, but they are still there.
+            manifest.keep(kinds=('file',), directory=discussion_dir, recursive=False)
+            continue
+
         discussion_dir.mkdir(parents=True, exist_ok=True)
 
         for file in get_embedded_files(resolved_course.course, discussion.body):
-            file.download(discussion_dir / file.display_name)
+            download_canvas_file(file, discussion_dir / file.display_name, manifest)
+
+        if not (fastrender.enabled() and fastrender.save_discussion(resolved_course.course, discussion, discussion_dir, "discussion")):
+            for i in range(discussion.amount_pages):
+                filename = "discussion_" + str(i + 1) + ".html"
+                page_futures.append(submit_page(discussion.url + "/page-" + str(i + 1), discussion_dir, filename, overwrite=True))
+        manifest.record('discussion', discussion.id, discussion.updated_at, discussion_dir / "discussion_1.html")
+
+    # The index only needs to be saved again if something listed on it changed.
+    page_futures.append(submit_page(global_consts.API_URL + "/courses/" + str(resolved_course.course_id) + "/discussion_topics/", base_discussion_dir, "discussions.html", overwrite=manifest.has_changes('discussion')))
 
-        for i in range(discussion.amount_pages):
-            filename = "discussion_" + str(i + 1) + ".html"
-            download_page(discussion.url + "/page-" + str(i + 1), discussion_dir, filename)
+    wait_pages(page_futures)
 
 
 def download_assignments(course_view: CanvasCourse):
@@ -68,12 +87,19 @@ def download_assignments(course_view: CanvasCourse):
     base_assign_dir = global_consts.OUTPUT_LOCATION / course_view.term / course_view.name / 'assignments'
     base_assign_dir.mkdir(parents=True, exist_ok=True)
 
+    manifest = get_manifest(base_assign_dir.parent)
+
     # (base_assign_dir / 'assignments.json').write_text(jsonify_anything(course_view.assignments))
-    download_page(global_consts.API_URL + "/courses/" + str(course_view.course_id) + "/assignments/", base_assign_dir, "assignments.html")
+    page_futures = []
+
+    with ThreadPoolExecutor(max_workers=global_consts.API_WORKERS) as executor:
+        download_func = partial(download_assignment, base_assign_dir, course_view.course, manifest)
+        for futures in tqdm(executor.map(download_func, course_view.assignments), total=len(course_view.assignments), desc='Downloading Assignments'):
+            page_futures.extend(futures)
+
+    page_futures.append(submit_page(global_consts.API_URL + "/courses/" + str(course_view.course_id) + "/assignments/", base_assign_dir, "assignments.html", overwrite=manifest.has_changes('assignment')))
 
-    with ThreadPoolExecutor(max_workers=3) as executor:
-        download_func = partial(download_assignment, base_assign_dir, course_view.course)
-        list(tqdm(executor.map(download_func, course_view.assignments), total=len(course_view.assignments), desc='Downloading Assignments'))
+    wait_pages(page_futures)
 
 
 def download_course_announcement_pages(resolved_course: CanvasCourse):
@@ -82,9 +108,10 @@ def download_course_announcement_pages(resolved_course: CanvasCourse):
 
     base_announce_dir = global_consts.OUTPUT_LOCATION / resolved_course.term / resolved_course.name / 'announcements'
     base_announce_dir.mkdir(parents=True, exist_ok=True)
+    manifest = get_manifest(base_announce_dir.parent)
 
     # (base_announce_dir / 'announcements.json').write_text(jsonify_anything(resolved_course.announcements))
-    download_page(global_consts.API_URL + "/courses/" + str(resolved_course.course_id) + "/announcements/", base_announce_dir, "announcements.html")
+    page_futures = []
 
     for announcement in tqdm(list(resolved_course.announcements), desc='Downloading Announcements'):
         announcements_title = make_valid_filename(str(announcement.title))
@@ -94,40 +121,58 @@ def download_course_announcement_pages(resolved_course: CanvasCourse):
         if not announcement.url:
             continue
 
+        if manifest.is_current('announcement', announcement.id, announcement.updated_at, announce_dir / "announcement_1.html"):
+            # Its embedded files weren't looked at, but they are still there.
+            manifest.keep(kinds=('file',), directory=announce_dir, recursive=False)
+            continue
+
         announce_dir.mkdir(parents=True, exist_ok=True)
 
         for file in get_embedded_files(resolved_course.course, announcement.body):
-            file.download(announce_dir / file.display_name)
+            download_canvas_file(file, announce_dir / file.display_name, manifest)
+
+        if not (fastrender.enabled() and fastrender.save_discussion(resolved_course.course, announcement, announce_dir, "announcement")):
+            for i in range(announcement.amount_pages):
+                filename = "announcement_" + str(i + 1) + ".html"
+                page_futures.append(submit_page(announcement.url + "/page-" + str(i + 1), announce_dir, filename, overwrite=True))
+        manifest.record('announcement', announcement.id, announcement.updated_at, announce_dir / "announcement_1.html")
 
-        for i in range(announcement.amount_pages):
-            filename = "announcement_" + str(i + 1) + ".html"
-            download_page(announcement.url + "/page-" + str(i + 1), announce_dir, filename)
+    page_futures.append(submit_page(global_consts.API_URL + "/courses/" + str(resolved_course.course_id) + "/announcements/", base_announce_dir, "announcements.html", overwrite=manifest.has_changes('announcement')))
+
+    wait_pages(page_futures)
 
 
 def download_course_home_page_html(course_view):
     dl_dir = global_consts.OUTPUT_LOCATION / course_view.term / course_view.name
     dl_dir.mkdir(parents=True, exist_ok=True)
-    download_page(global_consts.API_URL + "/courses/" + str(course_view.course_id), dl_dir, "homepage.html")
+    # There's nothing to tell us when the home page changed, so always save a fresh copy.
+    return submit_page(global_consts.API_URL + "/courses/" + str(course_view.course_id), dl_dir, "homepage.html", overwrite=True)
 
 
 def download_course_modules(course_view: CanvasCourse):
     modules_dir = global_consts.OUTPUT_LOCATION / course_view.term / course_view.name / 'modules'
     modules_dir.mkdir(parents=True, exist_ok=True)
+    manifest = get_manifest(modules_dir.parent)
 
     # (modules_dir / 'modules.json').write_text(jsonify_anything(course_view.modules))
-    download_page(global_consts.API_URL + "/courses/" + str(course_view.course_id) + "/modules/", modules_dir, "modules.html")
+    page_futures = []
 
-    with ThreadPoolExecutor(max_workers=3) as executor:
+    with ThreadPoolExecutor(max_workers=global_consts.API_WORKERS) as executor:
         for module in tqdm(list(course_view.modules), desc='Downloading Modules'):
             bar = tqdm(list(module.items), leave=False, desc=module.module.name)
-            futures = [executor.submit(download_module_item, course_view.course, module, item, modules_dir) for item in module.items]
-            for _ in as_completed(futures):
+            futures = [executor.submit(download_module_item, course_view.course, module, item, modules_dir, manifest) for item in module.items]
+            for future in as_completed(futures):
+                page_futures.extend(future.result())
                 bar.update()
             bar.close()
 
+    page_futures.append(submit_page(global_consts.API_URL + "/courses/" + str(course_view.course_id) + "/modules/", modules_dir, "modules.html", overwrite=manifest.has_changes('module_item')))
+
+    wait_pages(page_futures)
+
 
 def download_course_grades_page(course_view: CanvasCourse):
     dl_dir = global_consts.OUTPUT_LOCATION / course_view.term / course_view.name
     dl_dir.mkdir(parents=True, exist_ok=True)
     api_target = f'{global_consts.API_URL}/courses/{course_view.course_id}/grades'
-    download_page(api_target, dl_dir, "grades.html")
+    return submit_page(api_target, dl_dir, "grades.html", overwrite=True)
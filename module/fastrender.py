@@ -0,0 +1,197 @@
+import base64
+import html
+import mimetypes
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List
+from urllib.parse import urlsplit
+
+from canvasapi.course import Course
+from tqdm import tqdm
+
+from module.api.file import get_file_cache
+from module.api.references import extract_references
+from module.const import global_consts
+from module.get_canvas import DISCUSSION_ENTRIES_PER_PAGE
+from module.items import CanvasDiscussion, CanvasTopicEntry
+from module.transport import get_session, get_token_session
+
+TEMPLATE = '''<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{title}</title>
+<style>
+body {{ font-family: "Lato", "Helvetica Neue", Helvetica, Arial, sans-serif; color: #2d3b45; max-width: 960px; margin: 2em auto; padding: 0 1em; line-height: 1.5; }}
+header {{ border-bottom: 1px solid #c7cdd1; margin-bottom: 1.5em; }}
+.meta {{ color: #6b7780; font-size: 0.9em; }}
+.post {{ border-top: 1px solid #e8eaec; padding: 1em 0; }}
+.reply {{ margin-left: 2em; border-left: 3px solid #e8eaec; padding-left: 1em; }}
+img {{ max-width: 100%; height: auto; }}
+table {{ border-collapse: collapse; }}
+td, th {{ border: 1px solid #c7cdd1; padding: 0.3em 0.6em; }}
+</style>
+</head>
+<body>
+<header>
+<h1>{title}</h1>
+{meta}
+</header>
+<main>
+{body}
+</main>
+<footer class="meta"><p>Saved from <a href="{source_url}">{source_url}</a></p></footer>
+</body>
+</html>
+'''
+
+IMG_SRC_RE = re.compile(r'(<img\b[^>]*?\bsrc=)(["\'])(.*?)\2', re.IGNORECASE | re.DOTALL)
+RELATIVE_URL_RE = re.compile(r'(\b(?:href|src)=)(["\'])/(?!/)', re.IGNORECASE)
+
+_images = OrderedDict()
+_images_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return global_consts.FAST_RENDER and global_consts.SAVE_HTML
+
+
+def absolute_url(url: str) -> str:
+    if url.startswith('//'):
+        return 'https:' + url
+    if url.startswith('/'):
+        return global_consts.API_URL.rstrip('/') + url
+    return url
+
+
+def fetch_image(course: Course, url: str) -> str | None:
+    """
+    Return `url` as a data URI, or None if it can't be fetched or is too large to inline. Canvas files are fetched
+    through their API download URL and other Canvas URLs with the browser cookies. Images on other hosts are fetched
+    without either.
+    """
+    with _images_lock:
+        if url in _images:
+            _images.move_to_end(url)
+            return _images[url]
+
+    target, headers, content_type = absolute_url(url), {}, None
+    session = get_session() if urlsplit(target).netloc == urlsplit(global_consts.API_URL).netloc else get_token_session()
+    file_ids = [reference.id for reference in extract_references(url) if reference.kind == 'file']
+    if file_ids:
+        file = get_file_cache(course).get(file_ids[0])
+        if file is not None:
+            target, session = file.url, get_token_session()
+            headers['Authorization'] = f'Bearer {global_consts.API_KEY}'
+            content_type = getattr(file, 'content-type', None)
+
+    data_uri = None
+    if target.startswith(('http://', 'https://')):
+        try:
+            with session.get(target, headers=headers, stream=True, timeout=global_consts.DOWNLOAD_TIMEOUT) as r:
+                r.raise_for_status()
+                body = r.raw.read(global_consts.FAST_RENDER_MAX_IMAGE + 1, decode_content=True)
+                if len(body) <= global_consts.FAST_RENDER_MAX_IMAGE:
+                    content_type = r.headers.get('Content-Type', content_type) or mimetypes.guess_type(target.split('?')[0])[0]
+                    content_type = (content_type or 'application/octet-stream').split(';')[0]
+                    data_uri = f'data:{content_type};base64,{base64.b64encode(body).decode()}'
+        except Exception as e:
+            tqdm.write(f'Could not inline image {url}: {e}')
+
+    with _images_lock:
+        _images[url] = data_uri
+        # The same images (course banners, equation images) show up on many pages, but don't keep them all.
+        while len(_images) > global_consts.FAST_RENDER_IMAGE_CACHE:
+            _images.popitem(last=False)
+    return data_uri
+
+
+def prepare_body(course: Course, body: str) -> str:
+    """
+    Inline the images of an HTML body and make its remaining links absolute so they still lead to Canvas.
+    """
+    if not body:
+        return ''
+
+    def inline(m):
+        src = html.unescape(m.group(3))
+        if src.startswith('data:'):
+            return m.group(0)
+        data_uri = fetch_image(course, src)
+        return f'{m.group(1)}{m.group(2)}{data_uri or html.escape(absolute_url(src))}{m.group(2)}'
+
+    body = IMG_SRC_RE.sub(inline, body)
+    return RELATIVE_URL_RE.sub(lambda m: f'{m.group(1)}{m.group(2)}{global_consts.API_URL.rstrip("/")}/', body)
+
+
+def meta_html(*items) -> str:
+    items = [html.escape(str(item)) for item in items if item]
+    return f'<p class="meta">{" &middot; ".join(items)}</p>' if items else ''
+
+
+def write_page(path: Path, title: str, meta: str, body: str, source_url: str):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.html.tmp')
+    tmp_path.write_text(TEMPLATE.format(title=html.escape(title or ''), meta=meta, body=body, source_url=html.escape(source_url or '')), encoding='utf-8')
+    tmp_path.replace(path)
+
+
+def save(description: str, func, *args) -> bool:
+    # A page that can't be built from the API data is left to the browser.
+    try:
+        func(*args)
+        return True
+    except Exception as e:
+        tqdm.write(f'Fast render of {description} failed, falling back to the browser: {e}')
+        return False
+
+
+def save_assignment(course: Course, assignment, path: Path) -> bool:
+    def build():
+        meta = meta_html(
+            f"Due {assignment.due_at}" if getattr(assignment, 'due_at', None) else None,
+            f"{assignment.points_possible} points" if getattr(assignment, 'points_possible', None) is not None else None,
+            ', '.join(getattr(assignment, 'submission_types', None) or []),
+        )
+        write_page(path, assignment.name, meta, prepare_body(course, getattr(assignment, 'description', None) or ''), assignment.html_url)
+    return save(f'assignment {assignment.name}', build)
+
+
+def save_page(course: Course, page, title: str, source_url: str, path: Path) -> bool:
+    def build():
+        meta = meta_html(f"Updated {page.updated_at}" if getattr(page, 'updated_at', None) else None)
+        write_page(path, title or getattr(page, 'title', ''), meta, prepare_body(course, getattr(page, 'body', None) or ''), source_url)
+    return save(f'page {title}', build)
+
+
+def entry_html(course: Course, entry, css_class: str) -> str:
+    meta = meta_html(entry.author, entry.posted_date)
+    return f'<article class="{css_class}">{meta}{prepare_body(course, entry.body)}</article>'
+
+
+def save_discussion(course: Course, discussion: CanvasDiscussion, directory: Path, prefix: str) -> bool:
+    """
+    Save a discussion or announcement as `<prefix>_1.html`, `<prefix>_2.html`, ... with the same number of top level
+    entries on each page as Canvas shows, so the files line up with what the browser would have saved.
+    """
+    def build():
+        entries: List[CanvasTopicEntry] = discussion.topic_entries
+        per_page = DISCUSSION_ENTRIES_PER_PAGE
+        pages = [[] for _ in range(max(1, discussion.amount_pages))]
+        # Deleted entries aren't in the list but still take up their spot on Canvas' pages, so go by position.
+        for entry in entries:
+            pages[min(entry.index // per_page, len(pages) - 1)].append(entry)
+        topic = f'<article class="post">{prepare_body(course, discussion.body)}</article>'
+        for n, page_entries in enumerate(pages, 1):
+            posts = []
+            for entry in page_entries:
+                posts.append(entry_html(course, entry, 'post'))
+                posts.extend(entry_html(course, reply, 'post reply') for reply in entry.topic_replies)
+            title = discussion.title if len(pages) == 1 else f'{discussion.title} (page {n} of {len(pages)})'
+            body = (topic if n == 1 else '') + '\n'.join(posts)
+            write_page(Path(directory) / f'{prefix}_{n}.html', title, meta_html(discussion.author, discussion.posted_date), body, f'{discussion.url}/page-{n}')
+    return save(f'{prefix} {discussion.title}', build)
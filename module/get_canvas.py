@@ -1,117 +1,100 @@
-import re
+import math
 from typing import List
 
-import canvasapi
 import dateutil.parser
-from canvasapi.discussion_topic import DiscussionTopic
+from canvasapi.exceptions import ResourceDoesNotExist
 from tqdm import tqdm
 
+from module.api.file import get_embedded_files
+from module.api.paginate import fetch_all
 from module.const import global_consts
 from module.items import CanvasDiscussion, CanvasPage, CanvasTopicEntry, CanvasTopicReply, CanvasModule
+from module.manifest import CourseManifest
 
-HTML_ITEM_ATTACHED_FILE_RE = re.compile(r'<a .*? data-api-endpoint=\"(.*?)\" .*?>')
-CANVAS_API_FILE_ID_RE = re.compile(r'.*?/api/v1/courses/.*?/files/(.*?)$')
+# Canvas renders this many top level entries on each page of a discussion.
+DISCUSSION_ENTRIES_PER_PAGE = 50
 
 
-def find_course_modules(course) -> List[CanvasModule]:
-    # modules_dir = os.path.join(global_consts.OUTPUT_LOCATION, course_view.term, course_view.name, "modules")
+def list_course_modules(course):
+    # One request per page of modules instead of one per item.
+    return fetch_all(course.get_modules(include=['items', 'content_details'], per_page=100))
 
-    results = []
 
-    try:
-        modules = list(course.get_modules())
-        for module in tqdm(modules, desc='Fetching Modules'):
-            try:
-                resolved_module = CanvasModule(module)
-                for item in resolved_module.items:
-                    if item.item.type == 'Page':
-                        page = course.get_page(item.item.page_url)
-                        item.page = page
-                        if hasattr(page, 'body'):
-                            # Extract the attached files from the item's HTML.
-                            file_matches = re.findall(HTML_ITEM_ATTACHED_FILE_RE, page.body)
-                            for match in file_matches:
-                                file_id = re.match(CANVAS_API_FILE_ID_RE, match)
-                                if file_id:
-                                    try:
-                                        # Grab the metadata from the API.
-                                        canvas_file = course.get_file(file_id.group(1))
-                                        item.attached_files.add(canvas_file)
-                                    except canvasapi.exceptions.ResourceDoesNotExist:
-                                        continue
-                results.append(resolved_module)
-            except Exception as e:
-                tqdm.write(f"Skipping module file download that gave the following error: {e}")
-    except Exception as e:
-        tqdm.write(f"Skipping module file download that gave the following error: {e}")
+def resolve_module_page(course, page):
+    # Extract the attached files from the item's HTML.
+    attached_files = get_embedded_files(course, page.body) if getattr(page, 'body', None) else set()
+    return page, attached_files
+
+
+def module_page_urls(modules: List[CanvasModule]) -> List[str]:
+    # The same page is often linked from several modules, so only fetch each one once.
+    return list(dict.fromkeys(item.item.page_url for module in modules for item in module.items if item.item.type == 'Page'))
+
 
-    return results
+def attach_module_pages(modules: List[CanvasModule], pages: dict):
+    for module in modules:
+        for item in module.items:
+            if item.item.type == 'Page' and item.item.page_url in pages:
+                item.page, attached_files = pages[item.item.page_url]
+                item.attached_files.update(attached_files)
 
 
 def get_course_page_urls(course):
     page_urls = []
     try:
-        pages = list(course.get_pages())
-        for page in pages:
-            if hasattr(page, "url"):
-                page_urls.append(str(page.url))
-    except Exception as e:
-        if e.message != "Not Found":
-            print(f"Skipping page: {e}")
+        pages = fetch_all(course.get_pages())
+    except ResourceDoesNotExist:
+        # Pages are turned off for this course. Anything else is left to the caller, so a failed listing isn't
+        # mistaken for a course without pages.
+        return page_urls
+    for page in pages:
+        if hasattr(page, "url"):
+            page_urls.append(str(page.url))
     return page_urls
 
 
-def find_course_pages(course):
-    page_views = []
-    try:
-        page_urls = get_course_page_urls(course)
-        if not len(page_urls):
-            return
-
-        for url in tqdm(page_urls, desc='Fetching Pages'):
-            page = course.get_page(url)
-            page_view = CanvasPage()
-            page_view.id = page.id if hasattr(page, "id") else 0
-            page_view.title = str(page.title).replace('  ', ' ') if hasattr(page, "title") else ""
-            page_view.body = str(page.body) if hasattr(page, "body") else ""
-
-            if hasattr(page, "created_at"):
-                page_view.created_date = dateutil.parser.parse(page.created_at).strftime(global_consts.DATE_TEMPLATE)
-            else:
-                page_view.created_date = ''
-
-            if hasattr(page, "updated_at"):
-                page_view.last_updated_date = dateutil.parser.parse(page.updated_at).strftime(global_consts.DATE_TEMPLATE)
-            else:
-                page_view.last_updated_date = ''
-
-            page_views.append(page_view)
-    except Exception as e:
-        print("Skipping page download that gave the following error:")
-        print(e)
-    return page_views
+def resolve_page(page) -> CanvasPage:
+    page_view = CanvasPage()
+    page_view.id = page.id if hasattr(page, "id") else 0
+    page_view.title = str(page.title).replace('  ', ' ') if hasattr(page, "title") else ""
+    page_view.body = str(page.body) if hasattr(page, "body") else ""
+
+    if hasattr(page, "created_at"):
+        page_view.created_date = dateutil.parser.parse(page.created_at).strftime(global_consts.DATE_TEMPLATE)
+    else:
+        page_view.created_date = ''
+
+    if hasattr(page, "updated_at"):
+        page_view.last_updated_date = dateutil.parser.parse(page.updated_at).strftime(global_consts.DATE_TEMPLATE)
+    else:
+        page_view.last_updated_date = ''
+
+    return page_view
 
 
-def find_course_assignments(course):
-    results = []
-    assignments = list(course.get_assignments())
-    for assignment in tqdm(assignments, desc='Fetching Assignments'):
-        # Have to re-define the object because the `/api/v1/courses/:course_id/assignments` endpoint is sometimes outdated.
-        # The endpoint `/api/v1/courses/:course_id/assignments/:id` has the most up to date data.
-        assignment = course.get_assignment(assignment.id)
-        results.append(assignment)
-    return results
+def list_course_assignments(course):
+    # Pull the user's submission along with each assignment so the download stage doesn't need to ask for it.
+    return fetch_all(course.get_assignments(include=['submission', 'overrides'], per_page=100))
 
 
-def find_course_announcements(course):
-    announcement_views = []
-    announcements: List[DiscussionTopic] = list(course.get_discussion_topics(only_announcements=True))
+def assignment_is_stale(assignment, manifest: CourseManifest = None) -> bool:
+    if global_consts.REFETCH_ASSIGNMENTS:
+        return True
+    if not getattr(assignment, 'html_url', None) or not hasattr(assignment, 'description'):
+        return True
+    if manifest is None:
+        return False
+    # It changed since the last export, so get the authoritative copy.
+    entry = manifest.get('assignment', assignment.id)
+    return entry is not None and entry.get('updated_at') != getattr(assignment, 'updated_at', None)
 
-    for announcement in tqdm(announcements, desc='Fetching Announcements'):
-        discussion_view = get_discussion_view(announcement)
-        announcement_views.append(discussion_view)
 
-    return announcement_views
+def resolve_assignment(course, assignment, manifest: CourseManifest = None):
+    # The `/api/v1/courses/:course_id/assignments` endpoint is sometimes outdated.
+    # The endpoint `/api/v1/courses/:course_id/assignments/:id` has the most up to date data, so use it for anything that looks stale.
+    if assignment_is_stale(assignment, manifest):
+        return course.get_assignment(assignment.id, include=['submission', 'overrides'])
+    return assignment
 
 
 def get_discussion_view(discussion_topic):
@@ -123,57 +106,128 @@ def get_discussion_view(discussion_topic):
     discussion_view.posted_date = discussion_topic.created_at_date.strftime("%B %d, %Y %I:%M %p") if hasattr(discussion_topic, "created_at_date") else ""
     discussion_view.body = str(discussion_topic.message) if hasattr(discussion_topic, "message") else ""
     discussion_view.url = str(discussion_topic.html_url) if hasattr(discussion_topic, "html_url") else ""
+    discussion_view.updated_at = '|'.join(str(getattr(discussion_topic, k, '')) for k in ('updated_at', 'last_reply_at', 'discussion_subentry_count'))
 
-    # Keeps track of how many topic_entries there are.
-    topic_entries_counter = 0
-
-    # Topic entries
-    if hasattr(discussion_topic, "discussion_subentry_count") and discussion_topic.discussion_subentry_count > 0:
-        # Need to get replies to entries recursively?
-        discussion_topic_entries = discussion_topic.get_topic_entries()
+    root_entries = 0
+    if getattr(discussion_topic, "discussion_subentry_count", 0) > 0:
         try:
-            for topic_entry in discussion_topic_entries:
-                topic_entries_counter += 1
-
-                # Create new discussion view for the topic_entry
-                topic_entry_view = CanvasTopicEntry()
-                topic_entry_view.id = topic_entry.id if hasattr(topic_entry, "id") else 0
-                topic_entry_view.author = str(topic_entry.user_name) if hasattr(topic_entry, "user_name") else ""
-                topic_entry_view.posted_date = topic_entry.created_at_date.strftime("%B %d, %Y %I:%M %p") if hasattr(topic_entry, "created_at_date") else ""
-                topic_entry_view.body = str(topic_entry.message) if hasattr(topic_entry, "message") else ""
-
-                # Get this topic's replies
-                topic_entry_replies = topic_entry.get_replies()
-
-                try:
-                    for topic_reply in topic_entry_replies:
-                        # Create new topic reply view
-                        topic_reply_view = CanvasTopicReply()
-                        topic_reply_view.id = topic_reply.id if hasattr(topic_reply, "id") else 0
-                        topic_reply_view.author = str(topic_reply.user_name) if hasattr(topic_reply, "user_name") else ""
-                        topic_reply_view.posted_date = topic_reply.created_at_date.strftime("%B %d, %Y %I:%M %p") if hasattr(topic_reply, "created_at_date") else ""
-                        topic_reply_view.message = str(topic_reply.message) if hasattr(topic_reply, "message") else ""
-                        topic_entry_view.topic_replies.append(topic_reply_view)
-                except Exception as e:
-                    print("Tried to enumerate discussion topic entry replies but received the following error:")
-                    print(e)
-
-                discussion_view.topic_entries.append(topic_entry_view)
+            root_entries = load_entries_from_view(discussion_view, discussion_topic)
         except Exception as e:
-            print("Tried to enumerate discussion topic entries but received the following error:")
-            print(e)
+            # The view endpoint isn't always available (it's served from a cache Canvas builds on demand).
+            tqdm.write(f"Falling back to fetching discussion entries one by one for {discussion_view.title}: {e}")
+            discussion_view.topic_entries = []
+            root_entries = load_entries_recursively(discussion_view, discussion_topic)
 
     # Amount of pages.
     # Typically 50 topic entries are stored on a page before it creates another page.
-    discussion_view.amount_pages = int(topic_entries_counter / 50) + 1
+    discussion_view.amount_pages = max(1, math.ceil(root_entries / DISCUSSION_ENTRIES_PER_PAGE))
 
     return discussion_view
 
 
-def find_course_discussions(course):
-    discussion_views = []
-    discussion_topics = list(course.get_discussion_topics())
-    for discussion_topic in tqdm(discussion_topics, desc='Fetching Discussions'):
-        discussion_view = get_discussion_view(discussion_topic)
-        discussion_views.append(discussion_view)
-    return discussion_views
+def format_api_date(value) -> str:
+    if not value:
+        return ""
+    return dateutil.parser.parse(value).strftime(global_consts.DATE_TEMPLATE)
+
+
+def fetch_discussion_tree(discussion_topic) -> dict:
+    # Not wrapped by canvasapi. Returns the whole threaded discussion and its participants in one response.
+    endpoint = f'{discussion_topic._parent_type}s/{discussion_topic._parent_id}/discussion_topics/{discussion_topic.id}/view'
+    return discussion_topic._requester.request('GET', endpoint).json()
+
+
+def load_entries_from_view(discussion_view: CanvasDiscussion, discussion_topic) -> int:
+    """
+    Fill in the entries of a discussion from the full view endpoint and return how many top level entries it has.
+    """
+    tree = fetch_discussion_tree(discussion_topic)
+    names = {p.get('id'): p.get('display_name', '') for p in tree.get('participants', [])}
+    entries = list(tree.get('view', []))
+
+    # Entries posted after Canvas cached the view are returned separately, so hang them on their parents.
+    by_id = {}
+    pending = list(entries)
+    while pending:
+        entry = pending.pop()
+        by_id[entry.get('id')] = entry
+        pending.extend(entry.get('replies', []))
+    for entry in tree.get('new_entries', None) or []:
+        if entry.get('id') in by_id:
+            continue
+        parent = by_id.get(entry.get('parent_id'))
+        if parent is None:
+            entries.append(entry)
+        else:
+            parent.setdefault('replies', []).append(entry)
+        by_id[entry.get('id')] = entry
+
+    for index, entry in enumerate(entries):
+        # Deleted entries still take up a spot on the rendered pages, but have nothing to save.
+        if entry.get('deleted'):
+            continue
+        topic_entry_view = CanvasTopicEntry()
+        topic_entry_view.index = index
+        topic_entry_view.id = entry.get('id', 0)
+        topic_entry_view.author = names.get(entry.get('user_id'), '')
+        topic_entry_view.posted_date = format_api_date(entry.get('created_at'))
+        topic_entry_view.body = str(entry.get('message') or '')
+
+        # Replies can nest to any depth, flatten them in the order they were posted.
+        replies = list(entry.get('replies', []))
+        while replies:
+            reply = replies.pop(0)
+            replies[0:0] = reply.get('replies', [])
+            if reply.get('deleted'):
+                continue
+            topic_reply_view = CanvasTopicReply()
+            topic_reply_view.id = reply.get('id', 0)
+            topic_reply_view.author = names.get(reply.get('user_id'), '')
+            topic_reply_view.posted_date = format_api_date(reply.get('created_at'))
+            topic_reply_view.body = str(reply.get('message') or '')
+            topic_entry_view.topic_replies.append(topic_reply_view)
+
+        discussion_view.topic_entries.append(topic_entry_view)
+
+    return len(entries)
+
+
+def load_entries_recursively(discussion_view: CanvasDiscussion, discussion_topic) -> int:
+    # Keeps track of how many topic_entries there are.
+    topic_entries_counter = 0
+
+    # Need to get replies to entries recursively?
+    discussion_topic_entries = discussion_topic.get_topic_entries()
+    try:
+        for topic_entry in discussion_topic_entries:
+            # Create new discussion view for the topic_entry
+            topic_entry_view = CanvasTopicEntry()
+            topic_entry_view.index = topic_entries_counter
+            topic_entries_counter += 1
+            topic_entry_view.id = topic_entry.id if hasattr(topic_entry, "id") else 0
+            topic_entry_view.author = str(topic_entry.user_name) if hasattr(topic_entry, "user_name") else ""
+            topic_entry_view.posted_date = topic_entry.created_at_date.strftime("%B %d, %Y %I:%M %p") if hasattr(topic_entry, "created_at_date") else ""
+            topic_entry_view.body = str(topic_entry.message) if hasattr(topic_entry, "message") else ""
+
+            # Get this topic's replies
+            topic_entry_replies = topic_entry.get_replies()
+
+            try:
+                for topic_reply in topic_entry_replies:
+                    # Create new topic reply view
+                    topic_reply_view = CanvasTopicReply()
+                    topic_reply_view.id = topic_reply.id if hasattr(topic_reply, "id") else 0
+                    topic_reply_view.author = str(topic_reply.user_name) if hasattr(topic_reply, "user_name") else ""
+                    topic_reply_view.posted_date = topic_reply.created_at_date.strftime("%B %d, %Y %I:%M %p") if hasattr(topic_reply, "created_at_date") else ""
+                    topic_reply_view.body = str(topic_reply.message) if hasattr(topic_reply, "message") else ""
+                    topic_entry_view.topic_replies.append(topic_reply_view)
+            except Exception as e:
+                print("Tried to enumerate discussion topic entry replies but received the following error:")
+                print(e)
+
+            discussion_view.topic_entries.append(topic_entry_view)
+    except Exception as e:
+        print("Tried to enumerate discussion topic entries but received the following error:")
+        print(e)
+
+    return topic_entries_counter
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+from functools import wraps
+from pathlib import Path
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from module.const import global_consts
+
+# Response headers worth keeping with a cached body. The rest describe the transfer, not the content.
+KEPT_HEADERS = ('Content-Type', 'Link', 'ETag', 'Last-Modified')
+
+
+class ResponseCache:
+    """
+    Keeps the bodies of API GET responses on disk with their ETag and Last-Modified values. Entries younger than
+    `ttl` seconds are used as they are, older ones are revalidated with If-None-Match / If-Modified-Since so an
+    unchanged response costs Canvas a 304 instead of rebuilding the JSON. When the cache grows past `max_bytes` the
+    least recently used entries are removed, and entries unused for `max_age` seconds are removed too.
+    """
+
+    def __init__(self, root: Path, ttl: float = 0, max_bytes: int = None, max_age: float = None, offline=False):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.offline = offline
+        self.stats = {'hits': 0, 'revalidated': 0, 'misses': 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def _paths(self, url: str):
+        key = self.key(url)
+        directory = self.root / key[:2]
+        return directory / (key + '.json'), directory / (key + '.body')
+
+    def _count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def load(self, url: str):
+        meta_path, body_path = self._paths(url)
+        try:
+            meta = json.loads(meta_path.read_text())
+            body = body_path.read_bytes()
+        except (OSError, ValueError):
+            return None
+        if meta.get('url') != url:
+            return None
+        return meta, body
+
+    def store(self, url: str, response: requests.Response):
+        meta_path, body_path = self._paths(url)
+        meta_path.parent.mkdir(parents=True, exist_ok=True)
+        meta = {
+            'url': url,
+            'status': response.status_code,
+            'headers': {k: response.headers[k] for k in KEPT_HEADERS if k in response.headers},
+            'stored_at': time.time(),
+        }
+        # Body first, so a crash never leaves metadata pointing at a body that isn't there.
+        for path, data in ((body_path, response.content), (meta_path, json.dumps(meta).encode())):
+            tmp_path = path.with_suffix(path.suffix + f'.{threading.get_ident()}.tmp')
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+
+    def _mark_used(self, url: str):
+        # Eviction goes by the modification time of the metadata file.
+        try:
+            os.utime(self._paths(url)[0])
+        except OSError:
+            pass
+
+    def touch(self, url: str):
+        # Revalidated, so it counts as fresh again.
+        entry = self.load(url)
+        if entry is not None:
+            meta, _ = entry
+            meta['stored_at'] = time.time()
+            meta_path, _ = self._paths(url)
+            tmp_path = meta_path.with_suffix(f'.{threading.get_ident()}.tmp')
+            tmp_path.write_text(json.dumps(meta))
+            os.replace(tmp_path, meta_path)
+
+    @staticmethod
+    def build_response(request: requests.PreparedRequest, meta: dict, body: bytes, status: int = None) -> requests.Response:
+        response = requests.Response()
+        response.status_code = status or meta['status']
+        response.reason = 'OK' if response.status_code < 400 else 'Not Cached'
+        response.headers = CaseInsensitiveDict(meta['headers'])
+        response._content = body
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(0)
+        return response
+
+    def send(self, send, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        """
+        Send `request` with the session's `send`, answering it from the cache where possible.
+        """
+        if request.method != 'GET':
+            return send(request, **kwargs)
+
+        url = request.url
+        entry = self.load(url)
+        if self.offline:
+            if entry is None:
+                self._count('misses')
+                # canvasapi turns this into ResourceDoesNotExist, which every caller already skips over.
+                return self.build_response(request, {'headers': {'Content-Type': 'application/json'}}, b'{"errors": [{"message": "Not in the offline cache"}]}', 404)
+            self._count('hits')
+            self._mark_used(url)
+            return self.build_response(request, *entry)
+
+        if entry is not None:
+            meta, body = entry
+            if time.time() - meta['stored_at'] < self.ttl:
+                self._count('hits')
+                self._mark_used(url)
+                return self.build_response(request, meta, body)
+            if 'ETag' in meta['headers']:
+                request.headers['If-None-Match'] = meta['headers']['ETag']
+            if 'Last-Modified' in meta['headers']:
+                request.headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+
+        response = send(request, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            self._count('revalidated')
+            self.touch(url)
+            return self.build_response(request, *entry)
+
+        self._count('misses')
+        if response.status_code == 200:
+            self.store(url, response)
+        return response
+
+    def evict(self):
+        """
+        Remove entries unused for longer than `max_age`, then the least recently used ones until the cache fits in
+        `max_bytes`.
+        """
+        entries = []
+        for meta_path in self.root.glob('*/*.json'):
+            body_path = meta_path.with_suffix('.body')
+            try:
+                stat = meta_path.stat()
+                size = stat.st_size + (body_path.stat().st_size if body_path.exists() else 0)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, size, meta_path, body_path))
+
+        now = time.time()
+        entries.sort()
+        total = sum(size for _, size, _, _ in entries)
+        for mtime, size, meta_path, body_path in entries:
+            too_old = self.max_age is not None and now - mtime > self.max_age
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not too_old and not too_big:
+                continue
+            meta_path.unlink(missing_ok=True)
+            body_path.unlink(missing_ok=True)
+            total -= size
+
+
+def install_response_cache(session: requests.Session, cache: ResponseCache):
+    """
+    Route every request of `session` through `cache`. Cached answers skip the session's response hooks, so they
+    don't count as requests or rate limit updates.
+    """
+    send = session.send
+
+    @wraps(send)
+    def cached_send(request, **kwargs):
+        return cache.send(send, request, **kwargs)
+
+    session.send = cached_send
+    return cache
+
+
+def get_response_cache(offline=False) -> ResponseCache:
+    return ResponseCache(
+        global_consts.OUTPUT_LOCATION / '.cache' / 'api',
+        ttl=global_consts.HTTP_CACHE_TTL,
+        max_bytes=global_consts.HTTP_CACHE_MAX_BYTES,
+        max_age=global_consts.HTTP_CACHE_MAX_AGE,
+        offline=offline,
+    )
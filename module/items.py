@@ -1,48 +1,20 @@
-import json
-from http.cookiejar import MozillaCookieJar
-from typing import List, Any
+from typing import List
 
-import requests
 from canvasapi.assignment import Assignment
 from canvasapi.course import Course
 from canvasapi.file import File
 from canvasapi.module import ModuleItem, Module
 from canvasapi.page import Page
 
+from module.api.paginate import fetch_all
 from module.helpers import make_valid_filename
-
-
-def varsify(item) -> Any:
-    result = {}
-    try:
-        if isinstance(item, (str, int, float, bool)):
-            return item
-        elif isinstance(item, (list, set)):
-            l_result = []
-            for i, x in enumerate(item):
-                l_result.append(varsify(x))
-            return l_result
-        else:
-            for k, v in vars(item).items():
-                if isinstance(v, dict):
-                    result[k] = varsify(v)
-                elif isinstance(v, list):
-                    result[k] = []
-                    for i, x in enumerate(v):
-                        result[k].insert(i, varsify(x))
-                else:
-                    if not k.startswith('_'):
-                        result[k] = varsify(v)
-            return result
-    except:
-        return item
-
-
-def jsonify_anything(item):
-    return json.dumps(varsify(item), indent=4, sort_keys=True, default=str)
+from module.spill import SpillableText
+from module.transport import get_session
 
 
 class CanvasModuleItem:
+    __slots__ = ('item', 'attached_files', 'page')
+
     def __init__(self, module_item: ModuleItem):
         self.item = module_item
         self.attached_files: set[File] = set()
@@ -53,12 +25,21 @@ class CanvasModule:
     def __init__(self, module: Module):
         self.module = module
         self.items: List[CanvasModuleItem] = []
-        for item in module.get_module_items():
-            i = self.module.get_module_item(item.id)
-            self.items.append(CanvasModuleItem(i))
+        # Modules listed with include[]=items already carry their items, but Canvas leaves them out of modules that
+        # have too many, so only ask for those separately.
+        items = getattr(module, 'items', None)
+        if items is None:
+            items = fetch_all(module.get_module_items(include=['content_details']))
+        else:
+            items = [ModuleItem(module._requester, {'course_id': module.course_id, **item}) for item in items]
+        for item in items:
+            self.items.append(CanvasModuleItem(item))
 
 
 class CanvasPage:
+    __slots__ = ('id', 'title', '_body', 'created_date', 'last_updated_date')
+    body = SpillableText()
+
     def __init__(self):
         self.id = 0
         self.title = ""
@@ -68,6 +49,9 @@ class CanvasPage:
 
 
 class CanvasTopicReply:
+    __slots__ = ('id', 'author', 'posted_date', '_body')
+    body = SpillableText()
+
     def __init__(self):
         self.id = 0
         self.author = ""
@@ -76,15 +60,23 @@ class CanvasTopicReply:
 
 
 class CanvasTopicEntry:
+    __slots__ = ('id', 'author', 'posted_date', '_body', 'topic_replies', 'index')
+    body = SpillableText()
+
     def __init__(self):
         self.id = 0
         self.author = ""
         self.posted_date = ""
         self.body = ""
         self.topic_replies = []
+        # Position among the discussion's top level entries, deleted ones included, which decides its page.
+        self.index = 0
 
 
 class CanvasDiscussion:
+    __slots__ = ('discussion', 'id', 'title', 'author', 'posted_date', '_body', 'topic_entries', 'url', 'amount_pages', 'updated_at')
+    body = SpillableText()
+
     def __init__(self, discussion):
         self.discussion = discussion
         self.id = 0
@@ -95,6 +87,8 @@ class CanvasDiscussion:
         self.topic_entries = []
         self.url = ""
         self.amount_pages = 0
+        # Changes whenever the topic is edited or gets a new post.
+        self.updated_at = ""
 
 
 class CanvasSubmission:
@@ -112,6 +106,8 @@ class CanvasSubmission:
 
 
 class CanvasCourse:
+    __slots__ = ('course', 'course_id', 'term', 'course_code', 'name', 'assignments', 'announcements', 'discussions', 'modules', 'pages')
+
     def __init__(self, course):
         self.course: Course = course
         self.course_id = course.id if hasattr(course, "id") else 0
@@ -130,11 +126,10 @@ class CanvasCourse:
         self.announcements: List[CanvasDiscussion] = []
         self.discussions: List[CanvasDiscussion] = []
         self.modules: List[CanvasModule] = []
+        self.pages: List[CanvasPage] = []
 
-    def test_course(self, base_url: str, cookie_jar: MozillaCookieJar):
-        s = requests.Session()
-        for cookie in cookie_jar:
-            s.cookies.set(cookie.name, cookie.value)
+    def test_course(self, base_url: str):
+        s = get_session()
         try:
             r = s.get(f'{base_url}/api/v1/courses/{self.course_id}')
             if not r.status_code == 200:
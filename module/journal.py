@@ -0,0 +1,122 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+JOURNAL_FILENAME = 'journal.sqlite'
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Journal:
+    """
+    Records every unit of work of an export (course probes, metadata stages, page renders and file downloads) with
+    its status in a SQLite database, so an interrupted run can pick up where it stopped and the remaining work can
+    be inspected. Every change is committed right away.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                course_id INTEGER,
+                status TEXT NOT NULL,
+                detail TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (kind, key)
+            )
+        ''')
+
+    def reset(self):
+        with self._lock:
+            self._db.execute('DELETE FROM jobs')
+
+    def mark(self, kind: str, key, status: str, course_id=None, detail: str = None):
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO jobs (kind, key, course_id, status, detail, updated_at) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (kind, key) DO UPDATE SET status = excluded.status, detail = excluded.detail, '
+                'updated_at = excluded.updated_at, course_id = COALESCE(excluded.course_id, course_id)',
+                (kind, str(key), course_id, status, detail, time.time()),
+            )
+
+    def status(self, kind: str, key):
+        with self._lock:
+            row = self._db.execute('SELECT status FROM jobs WHERE kind = ? AND key = ?', (kind, str(key))).fetchone()
+        return row[0] if row else None
+
+    def is_done(self, kind: str, key) -> bool:
+        return self.status(kind, key) == DONE
+
+    def summary(self):
+        with self._lock:
+            return self._db.execute('SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status ORDER BY kind, status').fetchall()
+
+    def unfinished(self):
+        with self._lock:
+            return self._db.execute(f"SELECT kind, key, course_id, status, detail FROM jobs WHERE status != '{DONE}' ORDER BY kind, key").fetchall()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_journal: Journal | None = None
+
+
+def open_journal(output_location: Path, resume=False) -> Journal:
+    """
+    Open the journal in the output directory. Unless resuming, whatever an earlier run left in it is cleared.
+    """
+    global _journal
+    _journal = Journal(Path(output_location) / JOURNAL_FILENAME)
+    if not resume:
+        _journal.reset()
+    return _journal
+
+
+def close_journal():
+    global _journal
+    if _journal is not None:
+        _journal.close()
+        _journal = None
+
+
+def get_journal() -> Journal | None:
+    return _journal
+
+
+def record(kind: str, key, status: str, course_id=None, detail: str = None):
+    # Does nothing when no journal is open, so the download helpers work without one.
+    if _journal is not None:
+        _journal.mark(kind, key, status, course_id, detail)
+
+
+def is_done(kind: str, key) -> bool:
+    return _journal is not None and _journal.is_done(kind, key)
+
+
+def print_journal(output_location: Path):
+    path = Path(output_location) / JOURNAL_FILENAME
+    if not path.is_file():
+        print('No journal found at', path)
+        return
+    journal = Journal(path)
+    try:
+        for kind, status, count in journal.summary():
+            print(f'{kind:>10} {status:>8}: {count}')
+        unfinished = journal.unfinished()
+        if unfinished:
+            print('\nNot finished:')
+            for kind, key, course_id, status, detail in unfinished:
+                print(f'  [{status}] {kind} {key}' + (f' (course {course_id})' if course_id else '') + (f': {detail}' if detail else ''))
+    finally:
+        journal.close()
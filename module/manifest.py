@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+MANIFEST_FILENAME = 'manifest.json'
+
+
+class CourseManifest:
+    """
+    Records what was exported for a course, keyed on the Canvas `updated_at` of each item, so later runs
+    only re-download what changed and can tell what was removed from Canvas.
+    """
+
+    def __init__(self, course_dir: Path):
+        self.course_dir = Path(course_dir)
+        self.path = self.course_dir / MANIFEST_FILENAME
+        self.entries = {}
+        self._seen = set()
+        self._changed_kinds = set()
+        self._lock = threading.Lock()
+        if self.path.is_file():
+            try:
+                self.entries = json.loads(self.path.read_text()).get('entries', {})
+            except (ValueError, AttributeError):
+                print('Ignoring unreadable manifest:', self.path)
+
+    @staticmethod
+    def _key(kind, item_id):
+        return f'{kind}:{item_id}'
+
+    def relative(self, path):
+        if path is None:
+            return None
+        try:
+            return str(Path(path).relative_to(self.course_dir))
+        except ValueError:
+            return str(path)
+
+    def is_current(self, kind, item_id, updated_at, path: Path = None) -> bool:
+        """
+        True if the item was exported before with the same `updated_at` and its output is still on disk.
+        """
+        key = self._key(kind, item_id)
+        with self._lock:
+            self._seen.add(key)
+            entry = self.entries.get(key)
+        if entry is None or entry.get('deleted') or entry.get('updated_at') != updated_at:
+            return False
+        if path is not None:
+            path = Path(path)
+            if not path.exists():
+                return False
+            if entry.get('size') is not None and path.is_file() and path.stat().st_size != entry['size']:
+                return False
+        return True
+
+    def get(self, kind, item_id):
+        with self._lock:
+            return self.entries.get(self._key(kind, item_id))
+
+    def record(self, kind, item_id, updated_at, path: Path = None, size: int = None):
+        if size is None and path is not None and Path(path).is_file():
+            size = Path(path).stat().st_size
+        key = self._key(kind, item_id)
+        with self._lock:
+            self._seen.add(key)
+            self._changed_kinds.add(kind)
+            self.entries[key] = {
+                'kind': kind,
+                'updated_at': updated_at,
+                'size': size,
+                'path': self.relative(path),
+            }
+
+    def keep(self, kinds=None, directory: Path = None, recursive=True):
+        """
+        Mark the entries of `kinds` whose output is in `directory` as seen without checking them, for output that
+        wasn't walked this run but is still on Canvas. Either filter can be left out.
+        """
+        directory = Path(self.relative(directory)) if directory is not None else None
+        with self._lock:
+            for key, entry in self.entries.items():
+                if kinds is not None and entry.get('kind') not in kinds:
+                    continue
+                if directory is not None:
+                    if not entry.get('path'):
+                        continue
+                    parent = Path(entry['path']).parent
+                    if parent != directory and not (recursive and directory in parent.parents):
+                        continue
+                self._seen.add(key)
+
+    def has_changes(self, kind) -> bool:
+        with self._lock:
+            return kind in self._changed_kinds
+
+    def finish(self, prune=False):
+        """
+        Flag every entry that wasn't seen during this run as deleted, or remove its output if `prune` is set.
+        Returns the keys of the entries that went missing.
+        """
+        missing = []
+        with self._lock:
+            for key, entry in list(self.entries.items()):
+                if key in self._seen or (entry.get('deleted') and not prune):
+                    continue
+                missing.append(key)
+                if prune:
+                    if entry.get('path'):
+                        output = self.course_dir / entry['path']
+                        if output.is_file():
+                            output.unlink()
+                    del self.entries[key]
+                else:
+                    entry['deleted'] = True
+        self.save()
+        return missing
+
+    def save(self):
+        self.course_dir.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            data = json.dumps({'entries': self.entries}, indent=4, sort_keys=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_text(data)
+        os.replace(tmp_path, self.path)
+
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def get_manifest(course_dir: Path) -> CourseManifest:
+    course_dir = Path(course_dir)
+    with _manifests_lock:
+        if course_dir not in _manifests:
+            _manifests[course_dir] = CourseManifest(course_dir)
+        return _manifests[course_dir]
@@ -0,0 +1,203 @@
+import cProfile
+import json
+import pstats
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from module.const import global_consts
+
+# Upper bounds in seconds of the latency and render duration histogram buckets.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+RENDER_BUCKETS = (1, 2.5, 5, 10, 30, 60, 120)
+
+# Before 3.12 cProfile only sees the thread that enabled it. From 3.12 on it is built on sys.monitoring, which sees
+# every thread but only allows one profiler to be active at a time.
+PER_THREAD_PROFILERS = sys.version_info < (3, 12)
+
+# Path segments that identify one object rather than a kind of endpoint.
+ID_SEGMENT_RE = re.compile(r'^(\d+|[0-9a-f]{32,}|sis_\w+:.*)$')
+
+
+def normalize_endpoint(url: str) -> str:
+    """
+    Group URLs by endpoint: `/api/v1/courses/123/pages/intro?page=2` becomes `/courses/:id/pages/:id`. Hosts other
+    than Canvas (file storage redirects) are kept so they show up on their own.
+    """
+    parts = urlsplit(url)
+    path = parts.path
+    if path.startswith('/api/v1/'):
+        path = path[len('/api/v1'):]
+    path = '/'.join(':id' if ID_SEGMENT_RE.match(segment) else segment for segment in path.split('/'))
+    # Page urls are names rather than numbers.
+    path = re.sub(r'/pages/[^/]+', '/pages/:id', path)
+    if parts.netloc and parts.netloc != urlsplit(global_consts.API_URL).netloc:
+        return parts.netloc + path
+    return path
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def to_data(self) -> dict:
+        labels = [f'<={b}' for b in self.buckets] + [f'>{self.buckets[-1]}']
+        return {
+            'count': self.count,
+            'total': round(self.total, 3),
+            'mean': round(self.total / self.count, 3) if self.count else 0,
+            'max': round(self.max, 3),
+            'buckets': dict(zip(labels, self.counts)),
+        }
+
+
+class Metrics:
+    """
+    Collects where the time of a run goes: wall time per phase and per course, API requests per endpoint, bytes
+    downloaded and SingleFile renders. Everything is thread safe and cheap enough to always be on.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.phases = {}
+        self.courses = {}
+        self.requests = {}
+        self.bytes_downloaded = 0
+        self.renders = Histogram(RENDER_BUCKETS)
+        self.render_failures = 0
+        self.assets = {'pages': 0, 'bytes_before': 0, 'bytes_after': 0}
+        self.profiling = False
+        self._profiles = []
+        self._local = threading.local()
+        self._shared_profiler = None
+        self._profiled_calls = 0
+
+    @contextmanager
+    def phase(self, name: str, course_id=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start, course_id)
+
+    def add_phase(self, name: str, seconds: float, course_id=None):
+        with self._lock:
+            phases = self.phases if course_id is None else self.courses.setdefault(course_id, {})
+            phases[name] = phases.get(name, 0) + seconds
+
+    def observe_response(self, response):
+        endpoint = f'{response.request.method} {normalize_endpoint(response.url)}'
+        with self._lock:
+            stats = self.requests.get(endpoint)
+            if stats is None:
+                stats = self.requests[endpoint] = {'latency': Histogram(LATENCY_BUCKETS), 'errors': 0}
+            stats['latency'].add(response.elapsed.total_seconds())
+            if response.status_code >= 400:
+                stats['errors'] += 1
+
+    def add_bytes(self, count: int):
+        with self._lock:
+            self.bytes_downloaded += count
+
+    def add_render(self, seconds: float, ok: bool):
+        with self._lock:
+            self.renders.add(seconds)
+            if not ok:
+                self.render_failures += 1
+
+    def add_assets(self, bytes_before: int, bytes_after: int):
+        with self._lock:
+            self.assets['pages'] += 1
+            self.assets['bytes_before'] += bytes_before
+            self.assets['bytes_after'] += bytes_after
+
+    def profiled(self, func, *args):
+        """
+        Run `func(*args)`, under cProfile if profiling is on. Where cProfile only sees the thread it runs in, every
+        worker thread gets its own profiler and they are merged when the report is written. Elsewhere one profiler
+        is shared and stays on while any profiled call is running.
+        """
+        if not self.profiling:
+            return func(*args)
+        if not PER_THREAD_PROFILERS:
+            return self._profiled_shared(func, *args)
+        profiler = getattr(self._local, 'profiler', None)
+        if profiler is None:
+            profiler = self._local.profiler = cProfile.Profile()
+            with self._lock:
+                self._profiles.append(profiler)
+        profiler.enable()
+        try:
+            return func(*args)
+        finally:
+            profiler.disable()
+
+    def _profiled_shared(self, func, *args):
+        with self._lock:
+            if self._shared_profiler is None:
+                self._shared_profiler = cProfile.Profile()
+                self._profiles.append(self._shared_profiler)
+            if not self._profiled_calls:
+                self._shared_profiler.enable()
+            self._profiled_calls += 1
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self._profiled_calls -= 1
+                if not self._profiled_calls:
+                    self._shared_profiler.disable()
+
+    def report(self, **extra) -> dict:
+        with self._lock:
+            return {
+                'started_at': datetime.fromtimestamp(self.started_at).isoformat(),
+                'wall_time': round(time.time() - self.started_at, 3),
+                'phases': {k: round(v, 3) for k, v in self.phases.items()},
+                'courses': {str(c): {k: round(v, 3) for k, v in p.items()} for c, p in self.courses.items()},
+                'requests': {
+                    'count': sum(s['latency'].count for s in self.requests.values()),
+                    'endpoints': {e: {'errors': s['errors'], **s['latency'].to_data()} for e, s in sorted(self.requests.items())},
+                },
+                'bytes_downloaded': self.bytes_downloaded,
+                'renders': {'failures': self.render_failures, **self.renders.to_data()},
+                'assets': dict(self.assets),
+                **extra,
+            }
+
+    def write_report(self, path: Path, **extra):
+        Path(path).write_text(json.dumps(self.report(**extra), indent=4))
+
+    def write_profile(self, path: Path) -> bool:
+        with self._lock:
+            profiles = [p for p in self._profiles if p.getstats()]
+        if not profiles:
+            return False
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(str(path))
+        return True
+
+
+run_metrics = Metrics()
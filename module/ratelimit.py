@@ -0,0 +1,147 @@
+import random
+import threading
+import time
+from contextlib import nullcontext
+
+from module.const import global_consts
+
+RATE_LIMIT_MESSAGE = 'Rate Limit Exceeded'
+
+
+def is_rate_limited(error: Exception) -> bool:
+    # canvasapi raises Forbidden (or RateLimitExceeded on newer versions) with the response body as the message.
+    return RATE_LIMIT_MESSAGE in str(error)
+
+
+class AdaptiveLimiter:
+    """
+    Caps the number of Canvas API requests in flight and adjusts the cap from the rate limit headers Canvas sends
+    back. Canvas gives every token a bucket of request cost that drains as requests run and refills over time.
+    While plenty of it is left we allow one more request at a time for every window of successful responses, and
+    once it runs low we halve the cap, well before Canvas starts answering 403.
+    """
+
+    def __init__(self, max_concurrent: int, start: int = None):
+        self.max_concurrent = max(1, max_concurrent)
+        self.limit = min(self.max_concurrent, max(1, start or global_consts.API_START_WORKERS))
+        self.in_flight = 0
+        # Last values reported by Canvas.
+        self.remaining = None
+        self.cost = None
+        self.throttled = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    self._cond.wait(pause)
+                elif self.in_flight >= self.limit:
+                    self._cond.wait()
+                else:
+                    break
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def observe(self, headers):
+        """
+        Update the cap from the X-Rate-Limit-Remaining and X-Request-Cost headers of an API response.
+        """
+        try:
+            remaining = float(headers['X-Rate-Limit-Remaining'])
+        except (KeyError, TypeError, ValueError):
+            return
+        try:
+            cost = float(headers.get('X-Request-Cost', 0))
+        except (TypeError, ValueError):
+            cost = 0
+
+        with self._cond:
+            self.remaining = remaining
+            self.cost = cost
+            # Stay clear of the point where every request in flight costs as much as this one and drains the bucket.
+            if remaining < max(global_consts.RATE_LIMIT_LOW, cost * self.limit * 2):
+                self._decrease()
+            elif remaining > global_consts.RATE_LIMIT_HIGH and self.limit < self.max_concurrent:
+                self._successes += 1
+                if self._successes >= self.limit:
+                    self._successes = 0
+                    self.limit += 1
+                    self._cond.notify_all()
+
+    def _decrease(self):
+        # Responses to requests that were already in flight report the same low budget, so only react once per window.
+        now = time.monotonic()
+        if now - self._last_decrease < global_consts.RATE_LIMIT_COOLDOWN:
+            return
+        self._last_decrease = now
+        self._successes = 0
+        self.limit = max(1, self.limit // 2)
+
+    def throttled_backoff(self, attempt: int) -> float:
+        """
+        Called after Canvas refused a request for exceeding the rate limit. Halves the cap and pauses every request,
+        not just the one that failed, for an exponentially growing jittered delay. Returns the delay.
+        """
+        delay = min(global_consts.RATE_LIMIT_MAX_BACKOFF, global_consts.RATE_LIMIT_BACKOFF * 2 ** attempt)
+        delay = random.uniform(delay / 2, delay)
+        with self._cond:
+            self.throttled += 1
+            self._last_decrease = 0.0
+            self._decrease()
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                'limit': self.limit,
+                'max_concurrent': self.max_concurrent,
+                'in_flight': self.in_flight,
+                'remaining': self.remaining,
+                'request_cost': self.cost,
+                'throttled': self.throttled,
+            }
+
+
+_api_limiter: AdaptiveLimiter | None = None
+
+
+def set_api_limiter(limiter: AdaptiveLimiter | None):
+    global _api_limiter
+    _api_limiter = limiter
+
+
+def api_throttled_backoff(attempt: int) -> float:
+    """
+    Back off after Canvas refused a request made outside canvasapi for exceeding the rate limit: through the API
+    limiter when one is installed, so every request is paused and the cap halved like for canvasapi's requests.
+    Returns the delay to wait before retrying.
+    """
+    if _api_limiter is not None:
+        return _api_limiter.throttled_backoff(attempt)
+    delay = min(global_consts.RATE_LIMIT_MAX_BACKOFF, global_consts.RATE_LIMIT_BACKOFF * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
+
+
+def api_slot():
+    """
+    Context manager that holds one of the API limiter's slots, for Canvas requests made outside canvasapi. Does
+    nothing when no limiter is installed.
+    """
+    return _api_limiter if _api_limiter is not None else nullcontext()
@@ -0,0 +1,78 @@
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from canvasapi import Canvas
+from canvasapi.exceptions import Forbidden
+from tqdm import tqdm
+
+from module.const import global_consts
+from module.ratelimit import AdaptiveLimiter, is_rate_limited, set_api_limiter
+
+
+class CourseFailed(Exception):
+    """
+    Raised by a course worker to stop processing that course without affecting the others.
+    """
+    pass
+
+
+def limit_api_requests(canvas: Canvas, max_concurrent: int) -> AdaptiveLimiter:
+    """
+    Limit the Canvas API requests in flight across every thread to what the rate limit allows, up to
+    `max_concurrent`, and retry requests Canvas throttled. All canvasapi objects created from `canvas` share its
+    requester, so wrapping it once covers them all. File downloads take a slot through `api_slot()`.
+    """
+    requester = canvas._Canvas__requester
+    limiter = AdaptiveLimiter(max_concurrent)
+    request = requester.request
+
+    # The headers are read off every response, including the errors canvasapi turns into exceptions.
+    requester._session.hooks['response'].append(lambda r, *args, **kwargs: limiter.observe(r.headers))
+
+    @wraps(request)
+    def limited_request(*args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                with limiter:
+                    return request(*args, **kwargs)
+            except Forbidden as e:
+                if not is_rate_limited(e) or attempt >= global_consts.RATE_LIMIT_RETRIES:
+                    raise
+                delay = limiter.throttled_backoff(attempt)
+                tqdm.write(f'Canvas rate limit exceeded, retrying in {delay:.1f}s with at most {limiter.limit} request(s) in flight.')
+                attempt += 1
+
+    requester.request = limited_request
+    set_api_limiter(limiter)
+    return limiter
+
+
+class CourseScheduler:
+    """
+    Runs the export of several courses at once. Stages within a course still run in order,
+    results come back in the same order as the input, and a failing course only affects itself.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = max(1, workers)
+
+    def run(self, courses, func):
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='course') as executor:
+            futures = [(course, executor.submit(func, course)) for course in courses]
+
+            results = []
+            for course, future in futures:
+                try:
+                    result = future.result()
+                except CourseFailed as e:
+                    print(f'Course {course.id} failed: {e}')
+                    continue
+                except Exception:
+                    print(f'Course {course.id} failed with an unexpected error:')
+                    traceback.print_exc()
+                    continue
+                if result is not None:
+                    results.append(result)
+            return results
@@ -0,0 +1,238 @@
+import json
+import re
+from datetime import date, datetime
+from typing import Any
+
+from canvasapi.assignment import Assignment, AssignmentOverride
+from canvasapi.course import Course
+from canvasapi.discussion_topic import DiscussionTopic
+from canvasapi.file import File
+from canvasapi.module import Module, ModuleItem
+from canvasapi.page import Page
+from canvasapi.paginated_list import PaginatedList
+
+from module.items import CanvasCourse, CanvasDiscussion, CanvasModule, CanvasModuleItem, CanvasPage, CanvasSubmission, CanvasTopicEntry, CanvasTopicReply
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The fields written out for each of our view classes.
+VIEW_FIELDS = {
+    CanvasCourse: ('course', 'course_id', 'term', 'course_code', 'name', 'assignments', 'announcements', 'discussions', 'modules', 'pages'),
+    CanvasModule: ('module', 'items'),
+    CanvasModuleItem: ('item', 'attached_files', 'page'),
+    CanvasPage: ('id', 'title', 'body', 'created_date', 'last_updated_date'),
+    CanvasTopicReply: ('id', 'author', 'posted_date', 'body'),
+    CanvasTopicEntry: ('id', 'author', 'posted_date', 'body', 'topic_replies'),
+    CanvasDiscussion: ('discussion', 'id', 'title', 'author', 'posted_date', 'body', 'topic_entries', 'url', 'amount_pages', 'updated_at'),
+    CanvasSubmission: ('id', 'attachments', 'grade', 'raw_score', 'submission_comments', 'total_possible_points', 'attempt', 'user_id', 'preview_url', 'ext_url'),
+}
+
+# The fields written out for each canvasapi class: the ones the Canvas REST API documents for that object. Fields
+# Canvas didn't return are left out, and for dates canvasapi parsed the `<field>_date` copy is written next to them.
+CANVAS_FIELDS = {
+    Course: (
+        'id', 'sis_course_id', 'uuid', 'integration_id', 'sis_import_id', 'name', 'course_code', 'original_name',
+        'workflow_state', 'account_id', 'root_account_id', 'enrollment_term_id', 'grading_periods',
+        'grading_standard_id', 'grade_passback_setting', 'created_at', 'start_at', 'end_at', 'locale', 'enrollments',
+        'total_students', 'calendar', 'default_view', 'syllabus_body', 'needs_grading_count', 'term', 'course_progress',
+        'apply_assignment_group_weights', 'permissions', 'is_public', 'is_public_to_auth_users', 'public_syllabus',
+        'public_syllabus_to_auth', 'public_description', 'storage_quota_mb', 'storage_quota_used_mb',
+        'hide_final_grades', 'license', 'allow_student_assignment_edits', 'allow_wiki_comments',
+        'allow_student_forum_attachments', 'open_enrollment', 'self_enrollment', 'restrict_enrollments_to_course_dates',
+        'course_format', 'access_restricted_by_date', 'time_zone', 'blueprint', 'blueprint_restrictions',
+        'blueprint_restrictions_by_object_type', 'template', 'homeroom_course', 'friendly_name', 'course_color',
+        'image_download_url', 'banner_image_download_url', 'concluded', 'is_favorite', 'teachers', 'tabs', 'sections',
+    ),
+    Assignment: (
+        'id', 'name', 'description', 'created_at', 'updated_at', 'due_at', 'lock_at', 'unlock_at', 'has_overrides',
+        'all_dates', 'course_id', 'html_url', 'submissions_download_url', 'assignment_group_id', 'due_date_required',
+        'allowed_extensions', 'max_name_length', 'turnitin_enabled', 'vericite_enabled', 'turnitin_settings',
+        'grade_group_students_individually', 'external_tool_tag_attributes', 'peer_reviews', 'automatic_peer_reviews',
+        'peer_review_count', 'peer_reviews_assign_at', 'intra_group_peer_reviews', 'anonymous_peer_reviews',
+        'group_category_id', 'needs_grading_count', 'needs_grading_count_by_section', 'position', 'post_to_sis',
+        'integration_id', 'integration_data', 'points_possible', 'submission_types', 'has_submitted_submissions',
+        'grading_type', 'grading_standard_id', 'published', 'unpublishable', 'only_visible_to_overrides',
+        'locked_for_user', 'lock_info', 'lock_explanation', 'quiz_id', 'anonymous_submissions', 'discussion_topic',
+        'freeze_on_copy', 'frozen', 'frozen_attributes', 'submission', 'use_rubric_for_grading', 'rubric_settings',
+        'rubric', 'assignment_visibility', 'overrides', 'omit_from_final_grade', 'hide_in_gradebook',
+        'moderated_grading', 'grader_count', 'final_grader_id', 'grader_comments_visible_to_graders',
+        'graders_anonymous_to_graders', 'grader_names_visible_to_final_grader', 'anonymous_grading',
+        'anonymous_instructor_annotations', 'allowed_attempts', 'post_manually', 'score_statistics', 'can_submit',
+        'annotatable_attachment_id', 'anonymize_students', 'require_lockdown_browser', 'important_dates', 'muted',
+        'graded_submissions_exist', 'is_quiz_assignment', 'in_closed_grading_period', 'workflow_state',
+        'restrict_quantitative_data',
+    ),
+    AssignmentOverride: (
+        'id', 'assignment_id', 'quiz_id', 'context_module_id', 'discussion_topic_id', 'wiki_page_id', 'attachment_id',
+        'student_ids', 'group_id', 'course_section_id', 'title', 'due_at', 'all_day', 'all_day_date', 'unlock_at',
+        'lock_at',
+    ),
+    Module: (
+        # `items` is left out: it's already written out by CanvasModule.items.
+        'id', 'course_id', 'workflow_state', 'position', 'name', 'unlock_at', 'require_sequential_progress',
+        'requirement_type', 'prerequisite_module_ids', 'items_count', 'items_url', 'state', 'completed_at',
+        'publish_final_grade', 'published',
+    ),
+    ModuleItem: (
+        'id', 'course_id', 'module_id', 'position', 'title', 'indent', 'type', 'content_id', 'html_url', 'url',
+        'page_url', 'external_url', 'new_tab', 'completion_requirement', 'content_details', 'published', 'quiz_lti',
+    ),
+    Page: (
+        'page_id', 'course_id', 'url', 'title', 'created_at', 'updated_at', 'hide_from_students', 'editing_roles',
+        'last_edited_by', 'body', 'published', 'publish_at', 'front_page', 'todo_date', 'locked_for_user', 'lock_info',
+        'lock_explanation', 'html_url',
+    ),
+    File: (
+        'id', 'uuid', 'folder_id', 'display_name', 'filename', 'content-type', 'url', 'size', 'created_at',
+        'updated_at', 'unlock_at', 'locked', 'hidden', 'lock_at', 'hidden_for_user', 'visibility_level',
+        'thumbnail_url', 'modified_at', 'mime_class', 'media_entry_id', 'locked_for_user', 'lock_info',
+        'lock_explanation', 'preview_url', 'category', 'upload_status', 'usage_rights', 'user',
+    ),
+    DiscussionTopic: (
+        'id', 'course_id', 'title', 'message', 'html_url', 'url', 'context_code', 'created_at', 'updated_at',
+        'posted_at', 'last_reply_at', 'delayed_post_at', 'lock_at', 'todo_date', 'require_initial_post',
+        'user_can_see_posts', 'discussion_subentry_count', 'read_state', 'unread_count', 'subscribed',
+        'subscription_hold', 'assignment_id', 'assignment', 'published', 'locked', 'pinned', 'position',
+        'is_announcement', 'is_section_specific', 'sections', 'locked_for_user', 'lock_info', 'lock_explanation',
+        'user_name', 'author', 'topic_children', 'group_topic_children', 'root_topic_id', 'podcast_url',
+        'podcast_has_student_posts', 'discussion_type', 'group_category_id', 'attachments', 'permissions',
+        'allow_rating', 'only_graders_can_rate', 'sort_by_rating', 'anonymous_state',
+    ),
+}
+
+# Written in place of an object that contains itself.
+CYCLE_MARKER = None
+
+# Spaces per level in the pretty-printed JSON files, as they have always been written.
+PRETTY_INDENT = 4
+
+# orjson can only indent by two and writes non-ASCII and some floats differently from `json.dumps`. These bring its
+# output in line with `json.dumps(data, indent=4, sort_keys=True)`, byte for byte.
+_INDENT_RE = re.compile(r'\n +')
+_NON_ASCII_RE = re.compile(r'[\x7f-\U0010ffff]')
+# Floats written in exponent form or with four leading zeros may differ (orjson writes 1e-5 and 0.00001234 where
+# json writes 1e-05 and 1.234e-05); json writes repr() of the float.
+_EXPONENT_HINT_RE = re.compile(r'e-?\d')
+_FLOAT_RE = re.compile(r'(?m)(?:^|(?<= ))(-?\d+(?:\.\d+)?e-?\d+|-?0\.0000\d+)(?=,?$)')
+
+
+def _escape_non_ascii(match) -> str:
+    c = ord(match.group(0))
+    if c > 0xFFFF:
+        c -= 0x10000
+        return '\\u%04x\\u%04x' % (0xD800 | (c >> 10), 0xDC00 | (c & 0x3FF))
+    return '\\u%04x' % c
+
+
+def _double_indent(text: str) -> str:
+    doubled = {}
+
+    def double(match):
+        indent = match.group(0)
+        return doubled.get(indent) or doubled.setdefault(indent, indent + indent[1:])
+    return _INDENT_RE.sub(double, text)
+
+
+def _canvas_projection(fields):
+    def project(obj):
+        attributes = vars(obj)
+        result = []
+        for k in fields:
+            if k in attributes:
+                result.append((k, attributes[k]))
+                if k + '_date' in attributes:
+                    result.append((k + '_date', attributes[k + '_date']))
+        return result
+    return project
+
+
+class Serializer:
+    """
+    Turns view objects and canvasapi objects into plain JSON data. Objects referenced from several places are only
+    converted once and contain-themselves cycles are cut off.
+    """
+
+    def __init__(self):
+        self._memo = {}
+        self._active = set()
+        self._fields = {}
+
+    def _fields_for(self, obj):
+        cls = type(obj)
+        if cls not in self._fields:
+            if cls in VIEW_FIELDS:
+                fields = VIEW_FIELDS[cls]
+                self._fields[cls] = lambda o: [(k, getattr(o, k)) for k in fields if hasattr(o, k)]
+            else:
+                canvas_cls = next((c for c in cls.__mro__ if c in CANVAS_FIELDS), None)
+                self._fields[cls] = _canvas_projection(CANVAS_FIELDS[canvas_cls]) if canvas_cls else None
+        return self._fields[cls]
+
+    def to_data(self, obj) -> Any:
+        if obj is None or isinstance(obj, (str, int, float, bool)):
+            return obj
+        if isinstance(obj, (datetime, date)):
+            return str(obj)
+
+        key = id(obj)
+        if key in self._memo:
+            return self._memo[key][1]
+        if key in self._active:
+            return CYCLE_MARKER
+
+        self._active.add(key)
+        try:
+            if isinstance(obj, dict):
+                result = {str(k): self.to_data(v) for k, v in obj.items()}
+            elif isinstance(obj, (list, tuple, set, frozenset, PaginatedList)):
+                result = [self.to_data(v) for v in obj]
+            else:
+                fields = self._fields_for(obj)
+                if fields is None:
+                    raise TypeError(f'Cannot serialize {type(obj).__name__}: add it to VIEW_FIELDS or CANVAS_FIELDS')
+                result = {k: self.to_data(v) for k, v in fields(obj)}
+        finally:
+            self._active.discard(key)
+
+        # The object is kept alongside its result so its id can't be reused by another object while this is alive.
+        self._memo[key] = (obj, result)
+        return result
+
+
+def to_data(item) -> Any:
+    return Serializer().to_data(item)
+
+
+def _pretty_orjson(data) -> str:
+    text = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode()
+    text = _double_indent(text)
+    if '0.0000' in text or _EXPONENT_HINT_RE.search(text):
+        text = _FLOAT_RE.sub(lambda m: repr(float(m.group(1))), text)
+    if not text.isascii() or '\x7f' in text:
+        text = _NON_ASCII_RE.sub(_escape_non_ascii, text)
+    return text
+
+
+def dumps(data, pretty=False) -> str:
+    """
+    `data` is plain JSON data, as returned by `to_data`. Pretty output is laid out exactly like
+    `json.dumps(data, indent=4, sort_keys=True)`, whether or not orjson is installed.
+    """
+    if orjson is not None:
+        try:
+            if pretty:
+                return _pretty_orjson(data)
+            return orjson.dumps(data, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode()
+        except orjson.JSONEncodeError:
+            # Integers too large for 64 bits, which json can still write.
+            pass
+    if pretty:
+        return json.dumps(data, indent=PRETTY_INDENT, sort_keys=True)
+    return json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def jsonify_anything(item, pretty=True):
+    return dumps(to_data(item), pretty)
@@ -1,37 +1,388 @@
+import atexit
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import Future, wait
 from pathlib import Path
-from subprocess import run
+from queue import Empty, Queue
 
+from . import journal
+from .assets import submit_assets
 from .const import global_consts
+from .metrics import run_metrics
 
 SINGLEFILE_BINARY_PATH = "./node_modules/single-file/cli/single-file"
 
 # TODO: have this be specified by a required arg.
 CHROME_PATH = "/usr/bin/google-chrome"
 
+CHROME_ARGS = [
+    "--headless=new",
+    "--no-first-run",
+    "--no-default-browser-check",
+    "--disable-gpu",
+    "--remote-debugging-port=0",
+]
 
-def add_quotes(s):
-    return "\"" + str(s).strip("\"") + "\""
+# How long to wait for a freshly launched browser to open its DevTools port.
+CHROME_STARTUP_TIMEOUT = 30
 
+# SingleFile writes the source URL into a comment at the top of every page it saves.
+SAVED_URL_RE = re.compile(r'^\s*url: (\S+)', re.MULTILINE)
 
-def download_page(url, output_path, output_name_template=""):
-    # TODO: we can probably safely exclude pages that match the regex r'/external_tools/retrieve\?'
+# Added to the URLs of a batch so every saved page says which job it was for. Browsers keep the fragment through
+# redirects, so this still works when Canvas sends a URL on to another page, like it does for module items.
+JOB_TAG = '#canvas-export-job-'
+JOB_TAG_RE = re.compile(re.escape(JOB_TAG) + r'(\d+)$')
+
+# URLs Canvas always redirects, which can't be matched to their job in a batch without the tags.
+REDIRECTING_URL_RE = re.compile(r'/modules/items/\d+')
+
+# Set once a batch comes back with pages that lost their tags.
+_tags_lost = False
+
+
+class ChromeInstance:
+    """
+    A long-lived headless Chrome that SingleFile connects to instead of launching its own browser.
+    """
+
+    def __init__(self):
+        self.process = None
+        self.profile_dir = None
+        self.ws_endpoint = None
+
+    def start(self):
+        self.profile_dir = tempfile.mkdtemp(prefix='canvas-export-chrome-')
+        self.process = subprocess.Popen(
+            [CHROME_PATH, *CHROME_ARGS, f'--user-data-dir={self.profile_dir}', 'about:blank'],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+        # Chrome writes the port it picked and the browser target path to this file once DevTools is listening.
+        port_file = Path(self.profile_dir, 'DevToolsActivePort')
+        deadline = time.monotonic() + CHROME_STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'Chrome exited during startup with code {self.process.returncode}')
+            if port_file.is_file():
+                lines = port_file.read_text().splitlines()
+                if len(lines) >= 2:
+                    self.ws_endpoint = f'ws://127.0.0.1:{lines[0]}{lines[1]}'
+                    return
+            time.sleep(0.1)
+        self.stop()
+        raise RuntimeError('Timed out waiting for Chrome to start')
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+        self.ws_endpoint = None
+        if self.profile_dir:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            self.profile_dir = None
+
+
+class SingleFilePool:
+    """
+    A fixed number of warm browsers that take page renders from a shared queue.
+    """
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self.browser_launches = 0
+        self.reuse_browsers = True
+        self._queue = Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.size):
+            t = threading.Thread(target=self._worker, name=f'singlefile-{i}', daemon=True)
+            t.start()
+            self._workers.append(t)
+
+    def submit(self, url, output_path, output_name_template="") -> Future:
+        future = Future()
+        self._queue.put((url, output_path, output_name_template, future))
+        return future
+
+    def shutdown(self):
+        for _ in self._workers:
+            self._queue.put(None)
+        for t in self._workers:
+            t.join()
+        self._workers = []
+
+    def _next_batch(self):
+        job = self._queue.get()
+        if job is None:
+            return None
+        batch = [job]
+        while len(batch) < global_consts.RENDER_BATCH_SIZE:
+            try:
+                job = self._queue.get_nowait()
+            except Empty:
+                break
+            if job is None:
+                # Leave the shutdown signal for the next loop so every worker still gets exactly one.
+                self._queue.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def _worker(self):
+        browser = ChromeInstance()
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    break
+                batch = [job for job in batch if job[3].set_running_or_notify_cancel()]
+                if not batch:
+                    continue
+
+                if not self.reuse_browsers:
+                    browser.stop()
+                elif not browser.alive():
+                    browser.stop()
+                    try:
+                        browser.start()
+                        with self._lock:
+                            self.browser_launches += 1
+                    except Exception as e:
+                        # Let SingleFile launch its own browser rather than dropping the pages.
+                        print(f'Failed to start a pooled browser, falling back to a standalone one: {e}')
+                browser_server = browser.ws_endpoint if self.reuse_browsers else None
+
+                try:
+                    for jobs in split_batch(batch):
+                        if len(jobs) == 1:
+                            results = [run_singlefile(*jobs[0][:3], browser_server)]
+                        else:
+                            results = run_singlefile_batch([job[:3] for job in jobs], browser_server)
+                        for (url, output_path, output_name_template, future), result in zip(jobs, results):
+                            if result is None:
+                                # SingleFile didn't produce anything we could match to this URL, so try it on its own.
+                                result = run_singlefile(url, output_path, output_name_template, browser_server)
+                            future.set_result(result)
+                        if browser_server and any(results) and not browser.alive():
+                            self._stop_reusing()
+                            browser_server = None
+                except Exception as e:
+                    for job in batch:
+                        if not job[3].done():
+                            job[3].set_exception(e)
+        finally:
+            browser.stop()
+
+    def _stop_reusing(self):
+        # The browser went away while SingleFile saved pages with it, so SingleFile closed it instead of only
+        # disconnecting. Relaunching it for every batch would cost more than letting SingleFile start its own.
+        with self._lock:
+            if not self.reuse_browsers:
+                return
+            self.reuse_browsers = False
+        print('SingleFile closed a pooled browser after using it; letting SingleFile launch its own browsers instead.')
+
+
+def split_batch(batch):
+    # Without the tags, the pages Canvas redirects are saved on their own so they aren't saved twice.
+    if len(batch) == 1 or not _tags_lost:
+        return [batch]
+    rest, alone = [], []
+    for job in batch:
+        (alone if REDIRECTING_URL_RE.search(job[0]) else rest).append(job)
+    return ([rest] if rest else []) + [[job] for job in alone]
+
+
+_pool: SingleFilePool | None = None
+
+
+def start_render_pool(size: int):
+    global _pool
+    if _pool is None:
+        _pool = SingleFilePool(size)
+        _pool.start()
+        # Don't leave orphaned browsers behind if the export quits early.
+        atexit.register(stop_render_pool)
+    return _pool
 
-    if output_name_template and Path(output_path, output_name_template).exists():
-        print('exists')
-        return
 
+def stop_render_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def singlefile_args(output_path, browser_server=None):
     args = [
-        add_quotes(SINGLEFILE_BINARY_PATH),
-        "--browser-executable-path=" + add_quotes(CHROME_PATH.strip("\"")),
-        "--browser-cookies-file=" + add_quotes(global_consts.COOKIES_PATH),
-        "--output-directory=" + add_quotes(output_path),
-        add_quotes(url)
+        "node",
+        SINGLEFILE_BINARY_PATH,
+        "--browser-executable-path=" + CHROME_PATH.strip("\""),
+        "--browser-cookies-file=" + str(global_consts.COOKIES_PATH),
+        "--output-directory=" + str(output_path),
     ]
+    if browser_server:
+        args.append("--browser-server=" + browser_server)
+    return args
+
+
+def run_singlefile(url, output_path, output_name_template="", browser_server=None):
+    args = singlefile_args(output_path, browser_server)
+    args.append(url)
 
     if output_name_template != "":
-        args.append("--filename-template=" + add_quotes(output_name_template))
+        args.append("--filename-template=" + output_name_template)
 
+    start = time.perf_counter()
     try:
-        run("node " + " ".join(args), shell=True)
+        result = subprocess.run(args)
     except Exception as e:
-        print("Was not able to save the URL " + url + " using singlefile. The reported error was " + e.strerror)
+        run_metrics.add_render(time.perf_counter() - start, False)
+        print("Was not able to save the URL " + url + " using singlefile. The reported error was " + str(e))
+        return False
+    # SingleFile can exit cleanly without saving anything, e.g. when the page timed out, so check for the file too.
+    ok = result.returncode == 0 and (not output_name_template or Path(output_path, output_name_template).is_file())
+    run_metrics.add_render(time.perf_counter() - start, ok)
+    if not ok:
+        print(f"SingleFile could not save {url} (exit code {result.returncode}).")
+    return ok
+
+
+def read_saved_url(path: Path):
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        m = SAVED_URL_RE.search(f.read(4096))
+    return m.group(1) if m else None
+
+
+def tag_url(url, n):
+    # A URL that already has a fragment is matched on the URL alone.
+    return url if '#' in url else f'{url}{JOB_TAG}{n}'
+
+
+def match_saved_pages(jobs, batch_dir: Path):
+    """
+    Find the page saved for each job in a batch, or None for the jobs SingleFile didn't save.
+    """
+    global _tags_lost
+    paths = [None] * len(jobs)
+    unclaimed = []
+    for path in batch_dir.iterdir():
+        saved_url = read_saved_url(path) or ''
+        m = JOB_TAG_RE.search(saved_url)
+        if m and int(m.group(1)) < len(jobs) and paths[int(m.group(1))] is None:
+            paths[int(m.group(1))] = path
+        else:
+            unclaimed.append((path, saved_url))
+    if unclaimed and not _tags_lost:
+        _tags_lost = True
+        print('SingleFile saved pages without their batch tags; saving pages Canvas redirects one at a time.')
+
+    for n, (url, _, _) in enumerate(jobs):
+        if paths[n] is None:
+            for i, (path, saved_url) in enumerate(unclaimed):
+                if saved_url == url:
+                    paths[n] = path
+                    del unclaimed[i]
+                    break
+
+    missing = [n for n, path in enumerate(paths) if path is None]
+    if len(missing) == 1 and len(unclaimed) == 1:
+        # Every page in the batch directory was saved for one of the jobs, so a single leftover page is the missing one.
+        paths[missing[0]] = unclaimed[0][0]
+    return paths
+
+
+def run_singlefile_batch(jobs, browser_server=None):
+    """
+    Save several pages with one SingleFile process through its URL list input, then move each saved page to the
+    directory and filename its caller asked for. Returns one result per job, or None for pages that couldn't be matched.
+    """
+    with tempfile.TemporaryDirectory(prefix='canvas-export-batch-') as tmp:
+        urls_file = Path(tmp, 'urls.txt')
+        urls_file.write_text(''.join(tag_url(url, n) + '\n' for n, (url, _, _) in enumerate(jobs)))
+        batch_dir = Path(tmp, 'pages')
+        batch_dir.mkdir()
+
+        args = singlefile_args(batch_dir, browser_server)
+        args.append("--urls-file=" + str(urls_file))
+        start = time.perf_counter()
+        try:
+            subprocess.run(args)
+        except Exception as e:
+            print("Was not able to save a batch of " + str(len(jobs)) + " URLs using singlefile. The reported error was " + str(e))
+            return [None] * len(jobs)
+        # Pages in a batch are saved one after the other, so split the time between them.
+        per_page = (time.perf_counter() - start) / len(jobs)
+
+        results = []
+        for (url, output_path, output_name_template), path in zip(jobs, match_saved_pages(jobs, batch_dir)):
+            run_metrics.add_render(per_page, path is not None)
+            if path is None:
+                results.append(None)
+                continue
+            Path(output_path).mkdir(parents=True, exist_ok=True)
+            shutil.move(path, Path(output_path, output_name_template or path.name))
+            results.append(True)
+        return results
+
+
+def submit_page(url, output_path, output_name_template="", overwrite=False) -> Future:
+    # TODO: we can probably safely exclude pages that match the regex r'/external_tools/retrieve\?'
+
+    if not global_consts.SAVE_HTML:
+        future = Future()
+        future.set_result(False)
+        return future
+
+    page_key = str(Path(output_path, output_name_template or url))
+    if output_name_template and journal.is_done('page', page_key) and Path(output_path, output_name_template).exists():
+        # Already saved by the run being resumed.
+        overwrite = False
+
+    if output_name_template and overwrite:
+        # SingleFile won't replace an existing file, so clear out the stale copy first.
+        Path(output_path, output_name_template).unlink(missing_ok=True)
+    elif output_name_template and Path(output_path, output_name_template).exists():
+        print('exists')
+        future = Future()
+        future.set_result(True)
+        return future
+
+    journal.record('page', page_key, journal.PENDING, detail=url)
+    if _pool is not None:
+        future = _pool.submit(url, output_path, output_name_template)
+    else:
+        future = Future()
+        future.set_result(run_singlefile(url, output_path, output_name_template))
+
+    def record_result(f):
+        saved = not f.exception() and f.result()
+        journal.record('page', page_key, journal.DONE if saved else journal.FAILED, detail=url)
+        if saved and output_name_template and Path(output_path, output_name_template).is_file():
+            submit_assets(Path(output_path, output_name_template))
+
+    future.add_done_callback(record_result)
+    return future
+
+
+def wait_pages(futures):
+    wait(futures)
+    for future in futures:
+        if future.exception():
+            traceback.print_exception(future.exception())
@@ -0,0 +1,62 @@
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+
+from module.const import global_consts
+
+_spill_dir = None
+_spill_lock = threading.Lock()
+
+
+def get_spill_dir() -> str:
+    global _spill_dir
+    with _spill_lock:
+        if _spill_dir is None:
+            _spill_dir = tempfile.mkdtemp(prefix='canvas-export-spill-')
+            atexit.register(shutil.rmtree, _spill_dir, True)
+        return _spill_dir
+
+
+class SpilledText:
+    """
+    A large string kept in a temporary file instead of memory. The file goes away with the object.
+    """
+    __slots__ = ('path',)
+
+    def __init__(self, text: str):
+        fd, self.path = tempfile.mkstemp(dir=get_spill_dir(), suffix='.html')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def read(self) -> str:
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def __del__(self):
+        try:
+            os.unlink(self.path)
+        except (OSError, AttributeError, TypeError):
+            pass
+
+
+class SpillableText:
+    """
+    Descriptor for HTML body attributes on slotted view classes. Strings over `global_consts.SPILL_THRESHOLD`
+    characters are moved to disk and read back when the attribute is accessed.
+    """
+
+    def __set_name__(self, owner, name):
+        self.slot = '_' + name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        value = getattr(obj, self.slot, "")
+        return value.read() if isinstance(value, SpilledText) else value
+
+    def __set__(self, obj, value):
+        if isinstance(value, str) and global_consts.SPILL_THRESHOLD and len(value) > global_consts.SPILL_THRESHOLD:
+            value = SpilledText(value)
+        setattr(obj, self.slot, value)
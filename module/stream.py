@@ -0,0 +1,144 @@
+import json
+import threading
+from pathlib import Path
+
+from module.serialize import PRETTY_INDENT, dumps, to_data
+
+# Record type in the stream -> list attribute on CanvasCourse.
+COURSE_LISTS = {
+    'assignment': 'assignments',
+    'announcement': 'announcements',
+    'discussion': 'discussions',
+    'module': 'modules',
+    'page': 'pages',
+}
+
+
+class MetadataStream:
+    """
+    Appends one JSON record per line as metadata is resolved, so nothing has to be held in memory until the end
+    of the run and a crash still leaves everything written so far on disk.
+    """
+
+    def __init__(self, path: Path, append=False, mirror: 'MetadataStream' = None):
+        self.path = Path(path)
+        # Another stream that gets a copy of every record, serialized only once.
+        self.mirror = mirror
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'a' if append else 'w', encoding='utf-8')
+
+    def write(self, record_type: str, course_id, data):
+        self.write_line(dumps({'type': record_type, 'course_id': course_id, 'data': to_data(data)}))
+
+    def write_line(self, line: str):
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+        if self.mirror is not None:
+            self.mirror.write_line(line)
+
+    def write_course(self, course_view):
+        # The lists are streamed as their own records.
+        data = {k: v for k, v in to_data(course_view).items() if k not in COURSE_LISTS.values()}
+        self.write('course', course_view.course_id, data)
+
+    def write_items(self, stage: str, course_id, items):
+        record_type = next(t for t, attr in COURSE_LISTS.items() if attr == stage)
+        for item in items or []:
+            self.write(record_type, course_id, item)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def index_stream(f) -> dict:
+    """
+    Find where each course's records are in a metadata stream, without keeping the records themselves. Returns
+    `(offset, record type)` for every record of each course by course id, in the order the courses first appear.
+    """
+    courses = {}
+    f.seek(0)
+    while True:
+        offset = f.tell()
+        line = f.readline()
+        if not line:
+            break
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if record['type'] == 'course':
+            # A course written again was restarted by a resumed run, so whatever came before is incomplete.
+            courses[record['course_id']] = [(offset, 'course')]
+        else:
+            courses.setdefault(record['course_id'], []).append((offset, record['type']))
+    return courses
+
+
+def read_data(f, offset: int):
+    f.seek(offset)
+    return json.loads(f.readline())['data']
+
+
+def write_pretty(out, data, pad: str):
+    # Nested `pad` deep in the document. Strings in JSON can't hold a raw newline, so every newline starts a line.
+    out.write(dumps(data, pretty=True).replace('\n', '\n' + pad))
+
+
+def write_course(out, f, records, pad: str = ''):
+    """
+    Write one course the way `dumps(course, pretty=True)` would, reading its records back from the stream one at a
+    time so only a single item is ever held in memory.
+    """
+    indent = ' ' * PRETTY_INDENT
+    fields = {}
+    lists = {attr: [] for attr in COURSE_LISTS.values()}
+    for offset, record_type in records:
+        if record_type == 'course':
+            fields = read_data(f, offset)
+        else:
+            lists[COURSE_LISTS[record_type]].append(offset)
+
+    out.write('{')
+    for i, key in enumerate(sorted(set(fields) | set(lists))):
+        out.write((',' if i else '') + '\n' + pad + indent + dumps(key, pretty=True) + ': ')
+        if key not in lists:
+            write_pretty(out, fields[key], pad + indent)
+        elif not lists[key]:
+            out.write('[]')
+        else:
+            out.write('[')
+            for j, offset in enumerate(lists[key]):
+                out.write((',' if j else '') + '\n' + pad + indent * 2)
+                write_pretty(out, read_data(f, offset), pad + indent * 2)
+            out.write('\n' + pad + indent + ']')
+    out.write('\n' + pad + '}')
+
+
+def compact_stream(stream_path: Path, output_path: Path, single_course=False):
+    """
+    Build the legacy combined JSON file (a list of courses with their items nested inside) from a metadata stream,
+    one record at a time. With `single_course` the stream holds one course and the file is just that course, like
+    the per-course JSON.
+    """
+    # Binary, so the offsets from tell() can be seeked back to.
+    with open(stream_path, 'rb') as f, open(output_path, 'w', encoding='utf-8') as out:
+        courses = index_stream(f)
+        if single_course:
+            records = next(iter(courses.values()), None)
+            if records:
+                write_course(out, f, records)
+            else:
+                out.write('{}')
+            return
+
+        if not courses:
+            out.write('[]')
+            return
+        # Same layout as dumping the whole list at once: each course is indented one level inside the brackets.
+        indent = ' ' * PRETTY_INDENT
+        out.write('[')
+        for i, records in enumerate(courses.values()):
+            out.write((',' if i else '') + '\n' + indent)
+            write_course(out, f, records, indent)
+        out.write('\n]')
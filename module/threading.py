@@ -5,76 +5,107 @@ from canvasapi.assignment import Assignment
 from canvasapi.course import Course
 from canvasapi.submission import Submission
 
-from module.api.file import get_embedded_files
+from module import fastrender
+from module.api.file import get_embedded_files, get_file_cache
 from module.const import global_consts
+from module.download import download_canvas_file
 from module.helpers import make_valid_filename, shorten_file_name
-from module.items import CanvasModuleItem, jsonify_anything, CanvasModule
-from module.singlefile import download_page
+from module.items import CanvasModuleItem, CanvasModule
+from module.manifest import CourseManifest
+from module.singlefile import submit_page
 
 
-def download_module_item(course: Course, module: CanvasModule, item: CanvasModuleItem, modules_dir: Path):
+def download_module_item(course: Course, module: CanvasModule, item: CanvasModuleItem, modules_dir: Path, manifest: CourseManifest):
+    page_futures = []
     try:
         module_name = make_valid_filename(str(module.module.name))
         module_name = shorten_file_name(module_name, len(module_name) - global_consts.MAX_FOLDER_NAME_SIZE)
         module_dir = modules_dir / module_name
 
         if not hasattr(item.item, 'url') or not item.item.url:
-            return
+            return page_futures
 
         module_dir.mkdir(parents=True, exist_ok=True)
 
+        # Module items don't have a timestamp of their own, so go by the content they point to.
+        updated_at = None
         if item.item.type == "File":
-            file = course.get_file(item.item.content_id)
+            file = get_file_cache(course).get(item.item.content_id)
+            if file is None:
+                return page_futures
+            updated_at = getattr(file, 'updated_at', None)
             module_file_path = module_dir / make_valid_filename(str(file.display_name))
-            file.download(module_file_path)
+            download_canvas_file(file, module_file_path, manifest)
         else:
+            if hasattr(item, 'page'):
+                updated_at = getattr(item.page, 'updated_at', None)
             # It's a page, so download the attached files.
             for file in item.attached_files:
-                file.download(module_dir / file.filename)
+                download_canvas_file(file, module_dir / file.filename, manifest)
 
         # Download the module page.
         html_filename = make_valid_filename(str(item.item.title)) + ".html"
-        download_page(item.item.html_url, module_dir, html_filename)
+        html_path = module_dir / html_filename
+        if not manifest.is_current('module_item', item.item.id, updated_at, html_path):
+            fast = fastrender.enabled() and item.item.type == "Page" and hasattr(item, 'page')
+            if not (fast and fastrender.save_page(course, item.page, item.item.title, item.item.html_url, html_path)):
+                page_futures.append(submit_page(item.item.html_url, module_dir, html_filename, overwrite=updated_at is not None))
+            manifest.record('module_item', item.item.id, updated_at, html_path)
     except:
         # TODO: wrap all threaded funcs in this try/catch
         traceback.print_exc()
+    return page_futures
 
 
-def download_assignment(base_assign_dir: Path, course: Course, assignment: Assignment):
+def download_assignment(base_assign_dir: Path, course: Course, manifest: CourseManifest, assignment: Assignment):
+    page_futures = []
     try:
         assignment_title = make_valid_filename(str(assignment.name))
         assignment_title = shorten_file_name(assignment_title, len(assignment_title) - global_consts.MAX_FOLDER_NAME_SIZE)
         assign_dir = Path(base_assign_dir, assignment_title)
         assign_dir.mkdir(parents=True, exist_ok=True)
 
-        if assignment.html_url:
-            download_page(assignment.html_url, assign_dir, "assignment.html")
+        updated_at = getattr(assignment, 'updated_at', None)
+        if assignment.html_url and manifest.is_current('assignment', assignment.id, updated_at, assign_dir / "assignment.html"):
+            # Its embedded files weren't looked at, but they are still there.
+            manifest.keep(kinds=('file',), directory=assign_dir, recursive=False)
+        elif assignment.html_url:
+            if not (fastrender.enabled() and fastrender.save_assignment(course, assignment, assign_dir / "assignment.html")):
+                page_futures.append(submit_page(assignment.html_url, assign_dir, "assignment.html", overwrite=True))
+            manifest.record('assignment', assignment.id, updated_at, assign_dir / "assignment.html")
 
             # Download attached files.
             if assignment.description:
                 for file in get_embedded_files(course, assignment.description):
-                    file.download(assign_dir / file.display_name)
+                    download_canvas_file(file, assign_dir / file.display_name, manifest)
 
         # Students cannot view their past attempts, but this logic is left if that's ever implemented in Canvas.
-        submissions = [assignment.get_submission(global_consts.USER_ID)]
+        if isinstance(getattr(assignment, 'submission', None), dict):
+            # Already included with the assignment listing.
+            submissions = [Submission(assignment._requester, {'course_id': assignment.course_id, **assignment.submission})]
+        else:
+            submissions = [assignment.get_submission(global_consts.USER_ID)]
         for submission in submissions:
-            download_attempt(submission, assign_dir)
-            submission_dir = assign_dir / 'submission' / str(submission.id)
-            for attachment in submission.attachments:
-                filepath = submission_dir / attachment.display_name
-                if not filepath.exists():
-                    attachment.download(filepath)
+            page_futures.extend(download_attempt(submission, assign_dir, manifest))
     except:
         traceback.print_exc()
+    return page_futures
 
 
-def download_attempt(submission: Submission, assign_dir: Path):
+def download_attempt(submission: Submission, assign_dir: Path, manifest: CourseManifest):
+    page_futures = []
     try:
         submission_dir = assign_dir / 'submission' / str(submission.id)
         submission_dir.mkdir(parents=True, exist_ok=True)
         for file in submission.attachments:
-            file.download(submission_dir / file.display_name)
+            download_canvas_file(file, submission_dir / file.display_name, manifest)
         if submission.preview_url:
-            download_page(submission.preview_url, submission_dir, f'{submission.id}.html')
+            # Submissions change when they're resubmitted or graded, neither of which touches the assignment.
+            version = '|'.join(str(getattr(submission, k, '')) for k in ('submitted_at', 'graded_at', 'workflow_state'))
+            preview_path = submission_dir / f'{submission.id}.html'
+            if not manifest.is_current('submission', submission.id, version, preview_path):
+                page_futures.append(submit_page(submission.preview_url, submission_dir, f'{submission.id}.html', overwrite=True))
+                manifest.record('submission', submission.id, version, preview_path)
     except:
         traceback.print_exc()
+    return page_futures
@@ -0,0 +1,80 @@
+import threading
+
+import requests
+from canvasapi import Canvas
+from requests.adapters import HTTPAdapter
+
+from module.const import global_consts
+from module.metrics import run_metrics
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+_adapter: HTTPAdapter | None = None
+_session: requests.Session | None = None
+_token_session: requests.Session | None = None
+_lock = threading.Lock()
+
+
+def pool_size() -> int:
+    # Enough connections for every thread that can be talking to Canvas at the same time: the crawlers, each course's
+    # download stage and the user files.
+    return global_consts.API_WORKERS * (global_consts.COURSE_WORKERS + 2)
+
+
+def _get_adapter() -> HTTPAdapter:
+    global _adapter
+    if _adapter is None:
+        size = pool_size()
+        _adapter = HTTPAdapter(pool_connections=4, pool_maxsize=size, pool_block=False)
+    return _adapter
+
+
+def _mount(session: requests.Session):
+    adapter = _get_adapter()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.hooks['response'].append(lambda r, *args, **kwargs: run_metrics.observe_response(r))
+
+
+def get_session() -> requests.Session:
+    """
+    The session used for everything outside the API: frontend pages, course probes and file downloads.
+    It carries the browser cookies and shares its connection pool with the API session.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            s = requests.Session()
+            _mount(s)
+            s.headers['User-Agent'] = USER_AGENT
+            # Copying the cookies whole keeps their domains, so they are only sent back to the hosts that set them.
+            s.cookies.update(global_consts.COOKIE_JAR)
+            _session = s
+        return _session
+
+
+def get_token_session() -> requests.Session:
+    """
+    A session without the browser cookies, for requests that authenticate with the access token, like file downloads.
+    requests drops the Authorization header when a redirect leaves the Canvas host, so nothing identifying the user
+    follows a download to the file store.
+    """
+    global _token_session
+    with _lock:
+        if _token_session is None:
+            s = requests.Session()
+            _mount(s)
+            s.headers['User-Agent'] = USER_AGENT
+            _token_session = s
+        return _token_session
+
+
+def install_canvas_transport(canvas: Canvas):
+    """
+    Point canvasapi at the shared connection pool. The API session doesn't get the cookies since it authenticates
+    with the access token.
+    """
+    requester = canvas._Canvas__requester
+    with _lock:
+        _mount(requester._session)
+    return requester._session
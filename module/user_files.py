@@ -4,18 +4,21 @@ from pathlib import Path
 import canvasapi
 from tqdm import tqdm
 
+from module.api.paginate import fetch_all
+from module.const import global_consts
+from module.download import download_canvas_file
 from module.helpers import make_valid_folder_path
 
 
 def do_download(task):
     task[1].parent.mkdir(parents=True, exist_ok=True)
-    task[0].download(task[1])
+    download_canvas_file(task[0], task[1])
 
 
 def download_user_files(canvas: canvasapi.Canvas, base_path: Path):
     user = canvas.get_current_user()
     folders = []
-    for folder in user.get_folders():
+    for folder in fetch_all(user.get_folders()):
         n = folder.full_name.lstrip('my files/')
         if n:
             c_n = make_valid_folder_path(n)
@@ -23,11 +26,11 @@ def download_user_files(canvas: canvasapi.Canvas, base_path: Path):
 
     files = []
     for folder, folder_name in tqdm(folders, desc='Fetching User Files'):
-        for file in folder.get_files():
+        for file in fetch_all(folder.get_files()):
             out_path = base_path / folder_name / file.display_name
             files.append((file, out_path))
 
-    with ThreadPoolExecutor(max_workers=10) as executor:
+    with ThreadPoolExecutor(max_workers=global_consts.API_WORKERS) as executor:
         bar = tqdm(files, desc='Downloading User Files')
         futures = [executor.submit(do_download, task) for task in files]
         for _ in as_completed(futures):